@@ -0,0 +1,170 @@
+import asyncio
+from collections import deque
+from . import packet
+from .framing import Framer
+from .outbound import SendQueue
+from .liveness import LinkTimeout
+
+MAX_PENDING = 4096
+
+class ArtemisProtocol(asyncio.Protocol):
+    def __init__(self, provenance=packet.PacketProvenance.server, max_pending=MAX_PENDING,
+                 liveness=None):
+        self.framer = Framer(provenance)
+        self.liveness = liveness
+        self._timer = None
+        self.max_pending = max_pending
+        self.transport = None
+        self.packets = deque()
+        self.closed = False
+        self.exception = None
+        self._waiter = None
+        self._drain_waiters = deque()
+        self._write_paused = False
+        self._read_paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.liveness is not None:
+            self.liveness.reset()
+            self._schedule_liveness()
+
+    def _schedule_liveness(self):
+        loop = asyncio.get_event_loop()
+        self._timer = loop.call_later(self.liveness.wait(), self._check_liveness)
+
+    def _check_liveness(self):
+        if self.closed:
+            return
+        try:
+            self.liveness.check(self._send_heartbeat)
+        except LinkTimeout as e:
+            self.exception = e
+            self.transport.abort()
+            return
+        self._schedule_liveness()
+
+    def _send_heartbeat(self, heartbeat):
+        self.transport.write(packet.encode(heartbeat))
+
+    def data_received(self, data):
+        self.framer.feed(data)
+        received = list(self.framer.packets())
+        if self.liveness is not None:
+            now = self.liveness.clock()
+            self.liveness.received(now=now)
+            for received_packet in received:
+                if isinstance(received_packet, packet.HeartbeatPacket):
+                    self.liveness.received(received_packet, now)
+        self.packets.extend(received)
+        if len(self.packets) >= self.max_pending and not self._read_paused:
+            self._read_paused = True
+            self.transport.pause_reading()
+        self._wake()
+
+    def eof_received(self):
+        self.closed = True
+        self._wake()
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if exc is not None or self.exception is None:
+            self.exception = exc
+        if self._timer is not None:
+            self._timer.cancel()
+        self._wake()
+        self._write_paused = False
+        self._release_drain_waiters()
+
+    def pause_writing(self):
+        self._write_paused = True
+
+    def resume_writing(self):
+        self._write_paused = False
+        self._release_drain_waiters()
+
+    def _release_drain_waiters(self):
+        while self._drain_waiters:
+            waiter = self._drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _wake(self):
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def drain(self):
+        if self.closed and self.exception is not None:
+            raise self.exception
+        if not self._write_paused:
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        self._drain_waiters.append(waiter)
+        await waiter
+
+    async def get(self):
+        while not self.packets:
+            if self.closed:
+                if self.exception is not None:
+                    raise self.exception
+                raise EOFError('Connection closed')
+            self._waiter = asyncio.get_event_loop().create_future()
+            await self._waiter
+        received = self.packets.popleft()
+        if self._read_paused and len(self.packets) <= self.max_pending // 2:
+            self._read_paused = False
+            self.transport.resume_reading()
+        return received
+
+class Client:
+    def __init__(self, transport, protocol, provenance=packet.PacketProvenance.client):
+        self.transport = transport
+        self.protocol = protocol
+        self.provenance = provenance
+        self.queue = SendQueue(write=transport.write, provenance=provenance)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.protocol.get()
+        except EOFError:
+            raise StopAsyncIteration
+
+    async def recv(self):
+        return await self.protocol.get()
+
+    def write(self, pack):
+        self.transport.write(packet.encode(pack, provenance=self.provenance))
+
+    async def send(self, pack):
+        self.write(pack)
+        await self.protocol.drain()
+
+    async def send_many(self, packs):
+        self.transport.write(b''.join(packet.encode(pack, provenance=self.provenance)
+                                      for pack in packs))
+        await self.protocol.drain()
+
+    def put(self, pack):
+        # Schedules a packet through the client's SendQueue; see flush().
+        return self.queue.put(pack)
+
+    async def flush(self, max_bytes=None):
+        self.queue.flush(max_bytes)
+        await self.protocol.drain()
+
+    async def drain(self):
+        await self.protocol.drain()
+
+    def close(self):
+        self.transport.close()
+
+async def connect(host, port=2010, loop=None, **kwargs):
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    transport, protocol = await loop.create_connection(lambda: ArtemisProtocol(**kwargs),
+                                                       host, port)
+    return Client(transport, protocol)
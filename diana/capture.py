@@ -0,0 +1,91 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from array import array
+import os
+from .framing import MAGIC, HEADER, HEADER_SIZE
+from .pipeline import decode_frame
+
+CHUNK_FRAMES = 4096
+SEARCH_WINDOW = 65536
+
+def _find_magic(view, start):
+    end = len(view)
+    while start < end:
+        window = bytes(view[start:start + SEARCH_WINDOW + 3])
+        found = window.find(MAGIC)
+        if found != -1:
+            return start + found
+        start += SEARCH_WINDOW
+    return -1
+
+def index_frames(data, provenance=None):
+    # One pass over a raw capture, returning (offsets, lengths) arrays for
+    # every complete frame. Bytes that do not start a valid frame are
+    # skipped up to the next magic number.
+    view = memoryview(data)
+    offsets, lengths = array('Q'), array('I')
+    end = len(view)
+    offset = 0
+    while end - offset >= HEADER_SIZE:
+        if view[offset:offset + 4] != MAGIC:
+            offset = _find_magic(view, offset + 1)
+            if offset == -1:
+                break
+            continue
+        _magic, packet_len, origin, _padding, remaining, _ptype = HEADER.unpack_from(view, offset)
+        if (packet_len < HEADER_SIZE or remaining != packet_len - 20
+                                     or (provenance is not None and origin != provenance.value)):
+            offset += 1
+            continue
+        if end - offset < packet_len:
+            break
+        offsets.append(offset)
+        lengths.append(packet_len)
+        offset += packet_len
+    view.release()
+    return offsets, lengths
+
+def _decode_chunk(name, offsets, lengths):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        buf = shm.buf
+        results = []
+        for offset, length in zip(offsets, lengths):
+            _magic, _len, _origin, _padding, _remaining, ptype = HEADER.unpack_from(buf, offset)
+            results.append((offset, decode_frame(ptype, bytes(buf[offset:offset + length]))))
+        del buf
+        return results
+    finally:
+        shm.close()
+
+def decode_capture(path, workers=None, chunk_frames=CHUNK_FRAMES, provenance=None,
+                   window=None):
+    # Decodes a raw capture file across a process pool, yielding
+    # (offset, packet) in file order. The file is loaded once into shared
+    # memory; workers attach to it by name and receive only frame offsets.
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        with open(path, 'rb') as f:
+            f.readinto(shm.buf[:size])
+        offsets, lengths = index_frames(shm.buf[:size], provenance)
+        if window is None:
+            window = 2 * (workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(workers) as pool:
+            # At most `window` chunks are in flight or awaiting the consumer,
+            # so decoded packets never pile up for the whole file.
+            futures = deque()
+            for start in range(0, len(offsets), chunk_frames):
+                if len(futures) >= window:
+                    yield from futures.popleft().result()
+                futures.append(pool.submit(_decode_chunk, shm.name,
+                                           offsets[start:start + chunk_frames],
+                                           lengths[start:start + chunk_frames]))
+            while futures:
+                yield from futures.popleft().result()
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,185 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from enum import Enum
+from . import enumerations
+
+# A checkpoint file is a sequence of segments. A full segment replaces the
+# whole tracked state; incremental segments appended after it replace only
+# the objects they mention and list the objects destroyed in between.
+#
+# Segment layout (little-endian):
+#   header:   magic, flags, string count, object count, removed count, column count
+#   strings:  (byte length, utf-8 bytes) per string
+#   objects:  object ids (I)
+#   removed:  object ids (I)
+#   columns:  name string, type code, enum string, row count,
+#             row indices (I), values (d/q/B/I depending on type code)
+
+MAGIC = b'DCKP'
+FLAG_FULL = 0x01
+NO_ENUM = 0xffffffff
+
+HEADER = struct.Struct('<4sIIIII')
+COLUMN = struct.Struct('<IcxxxII')
+
+VALUE_FORMATS = {b'f': 'd', b'i': 'q', b'b': 'B', b'u': 'I', b'e': 'I', b's': 'I'}
+
+# arrays and memoryview casts use native byte order; swap on big-endian hosts
+# so that checkpoints are portable
+SWAP = sys.byteorder != 'little'
+
+def _array_bytes(values):
+    if SWAP:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _array_view(view, offset, fmt, count):
+    data = view[offset:offset + struct.calcsize(fmt) * count]
+    if SWAP:
+        values = array(fmt)
+        values.frombytes(data)
+        values.byteswap()
+        return values
+    return data.cast(fmt)
+
+def _classify(value):
+    if isinstance(value, bool):
+        return b'b', None
+    if isinstance(value, Enum):
+        return b'e', type(value)
+    if isinstance(value, int):
+        return b'i', None
+    if isinstance(value, float):
+        return b'f', None
+    if isinstance(value, str):
+        return b'u', None
+    if isinstance(value, (set, frozenset)) and value:
+        first = next(iter(value))
+        if isinstance(first, Enum):
+            return b's', type(first)
+    if isinstance(value, (set, frozenset)):
+        return b's', enumerations.EliteAbility
+    raise ValueError('Cannot checkpoint value {!r}'.format(value))
+
+class _StringTable:
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def __call__(self, string):
+        try:
+            return self.index[string]
+        except KeyError:
+            self.index[string] = len(self.strings)
+            self.strings.append(string)
+            return self.index[string]
+
+    def encode(self):
+        chunks = []
+        for string in self.strings:
+            data = string.encode('utf-8')
+            chunks.append(struct.pack('<I', len(data)))
+            chunks.append(data)
+        return b''.join(chunks)
+
+def encode_segment(objects, removed=(), full=True):
+    strings = _StringTable()
+    oids = array('I', objects.keys())
+    columns = {}
+    for row, obj in enumerate(objects.values()):
+        for field, value in obj.items():
+            code, enum = _classify(value)
+            key = (field, code, enum)
+            try:
+                rows, values = columns[key]
+            except KeyError:
+                rows, values = columns[key] = array('I'), array(VALUE_FORMATS[code])
+            rows.append(row)
+            if code == b'u':
+                values.append(strings(value))
+            elif code == b'e':
+                values.append(value.value)
+            elif code == b's':
+                values.append(sum(member.value for member in value))
+            else:
+                values.append(value)
+    column_chunks = []
+    for (field, code, enum), (rows, values) in columns.items():
+        column_chunks.append(COLUMN.pack(strings(field), code,
+                                         NO_ENUM if enum is None else strings(enum.__name__),
+                                         len(rows)))
+        column_chunks.append(_array_bytes(rows))
+        column_chunks.append(_array_bytes(values))
+    removed = array('I', removed)
+    header = HEADER.pack(MAGIC, FLAG_FULL if full else 0,
+                         len(strings.strings), len(oids), len(removed), len(columns))
+    return b''.join([header, strings.encode(), _array_bytes(oids), _array_bytes(removed)] +
+                    column_chunks)
+
+def _decode_value(code, enum, raw, strings):
+    if code == b'u':
+        return strings[raw]
+    if code == b'b':
+        return bool(raw)
+    if code == b'e':
+        return enum(raw)
+    if code == b's':
+        return {member for member in enum if member.value & raw}
+    return raw
+
+def decode_segments(data):
+    view = memoryview(data)
+    offset = 0
+    while offset < len(view):
+        magic, flags, nstrings, nobjects, nremoved, ncolumns = HEADER.unpack_from(view, offset)
+        if magic != MAGIC:
+            raise ValueError('Bad checkpoint segment at offset {}'.format(offset))
+        offset += HEADER.size
+        strings = []
+        for _ in range(nstrings):
+            length, = struct.unpack_from('<I', view, offset)
+            offset += 4
+            strings.append(str(view[offset:offset + length], 'utf-8'))
+            offset += length
+        oids = _array_view(view, offset, 'I', nobjects)
+        offset += 4 * nobjects
+        removed = _array_view(view, offset, 'I', nremoved).tolist()
+        offset += 4 * nremoved
+        objects = [{} for _ in range(nobjects)]
+        for _ in range(ncolumns):
+            name, code, enum_index, count = COLUMN.unpack_from(view, offset)
+            offset += COLUMN.size
+            fmt = VALUE_FORMATS[code]
+            width = struct.calcsize(fmt)
+            rows = _array_view(view, offset, 'I', count)
+            offset += 4 * count
+            values = _array_view(view, offset, fmt, count)
+            offset += width * count
+            field = strings[name]
+            enum = None if enum_index == NO_ENUM else getattr(enumerations, strings[enum_index])
+            for row, raw in zip(rows, values):
+                objects[row][field] = _decode_value(code, enum, raw, strings)
+        yield bool(flags & FLAG_FULL), removed, dict(zip(oids.tolist(), objects))
+
+def save(path, objects, removed=(), incremental=False):
+    segment = encode_segment(objects, removed, full=not incremental)
+    with open(path, 'ab' if incremental else 'wb') as f:
+        f.write(segment)
+
+def load(path):
+    objects = {}
+    if os.path.getsize(path) == 0:
+        return objects
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for full, removed, segment_objects in decode_segments(data):
+                if full:
+                    objects.clear()
+                for oid in removed:
+                    objects.pop(oid, None)
+                objects.update(segment_objects)
+    return objects
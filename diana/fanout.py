@@ -0,0 +1,174 @@
+from collections import deque
+from . import packet
+from .framing import HEADER_SIZE
+from .object_update import encode_obj_update_entry
+from .tracking import Tracker
+
+GAME_MESSAGE = packet.GameMessagePacket.packet_id
+GAME_START = (GAME_MESSAGE, 0)
+GAME_END = (GAME_MESSAGE, 6)
+
+# Frames replayed to late joiners ahead of the world state, in this order;
+# game messages are keyed by their subtype.
+SESSION = (
+    (packet.WelcomePacket.packet_id, None),
+    (packet.VersionPacket.packet_id, None),
+    (packet.DifficultyPacket.packet_id, None),
+    (GAME_MESSAGE, 15), # all ship settings
+    (GAME_MESSAGE, 9), # skybox
+    GAME_START,
+)
+
+# Packet types the world-state tracker needs to see decoded.
+TRACKED = frozenset([
+    packet.ObjectUpdatePacket.packet_id,
+    packet.DestroyObjectPacket.packet_id,
+    packet.IntelPacket.packet_id,
+    GAME_MESSAGE,
+])
+
+DROP = 'drop'
+RESYNC = 'resync'
+
+DEFAULT_MAXLEN = 1024
+MAX_BOOTSTRAP_PAYLOAD = 1024
+
+def session_key(ptype, frame):
+    if ptype == GAME_MESSAGE and len(frame) > HEADER_SIZE:
+        return ptype, frame[HEADER_SIZE]
+    return ptype, None
+
+def encode_world(objects, max_payload=MAX_BOOTSTRAP_PAYLOAD,
+                 provenance=packet.PacketProvenance.server):
+    # Object update frames carrying every encodable field of every object.
+    frames = []
+    entries, size = [], 0
+    for obj in objects:
+        try:
+            entry = encode_obj_update_entry(obj)
+        except (KeyError, ValueError):
+            continue
+        if entries and size + len(entry) > max_payload:
+            frames.append(entries)
+            entries, size = [], 0
+        entries.append(entry)
+        size += len(entry)
+    if entries:
+        frames.append(entries)
+    return [packet.encode(packet.ObjectUpdatePacket(b''.join(entries) + b'\x00\x00\x00\x00'),
+                          provenance=provenance)
+            for entries in frames]
+
+class Subscriber:
+    def __init__(self, maxlen=DEFAULT_MAXLEN, policy=RESYNC, wakeup=None):
+        self.frames = deque()
+        self.maxlen = maxlen
+        self.policy = policy
+        self.wakeup = wakeup
+        self.dropped = 0
+        self.resyncs = 0
+        self.closed = False
+        # bootstrap frames still queued do not count against maxlen
+        self.allowance = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def take(self):
+        frames = list(self.frames)
+        self.frames.clear()
+        self.allowance = 0
+        return frames
+
+    def reset(self, frames):
+        self.frames.clear()
+        self.frames.extend(frames)
+        self.allowance = len(frames)
+
+class FanOut:
+    # Broadcasts one upstream server stream to many downstream clients. Each
+    # frame is published once and the same bytes object is queued for every
+    # subscriber. A Tracker and the latest session frames are kept so late
+    # joiners can be sent the current world state before the live stream.
+    #
+    # Subscriber queues hold at most maxlen frames. When a slow client's
+    # queue is full the policy decides:
+    #   DROP    discard the new frame; the client's view may drift
+    #   RESYNC  discard the whole backlog and queue a fresh bootstrap
+    def __init__(self, tracker=None, maxlen=DEFAULT_MAXLEN, policy=RESYNC,
+                 provenance=packet.PacketProvenance.server):
+        self.tracker = Tracker() if tracker is None else tracker
+        self.maxlen = maxlen
+        self.policy = policy
+        self.provenance = provenance
+        self.session = {}
+        self.subscribers = []
+        self.frames = 0
+        self.closed = False
+        self._session_version = 0
+        self._bootstrap = None
+
+    def publish(self, ptype, frame):
+        self.frames += 1
+        key = session_key(ptype, frame)
+        if key in SESSION:
+            self.session[key] = frame
+            self._session_version += 1
+        elif key == GAME_END and GAME_START in self.session:
+            del self.session[GAME_START]
+            self._session_version += 1
+        if ptype in TRACKED:
+            self.tracker.rx(packet.decode_payload(ptype, frame[HEADER_SIZE:]))
+        for subscriber in self.subscribers:
+            self._deliver(subscriber, frame)
+
+    def _deliver(self, subscriber, frame):
+        if (subscriber.maxlen is not None and
+                len(subscriber.frames) >= subscriber.maxlen + subscriber.allowance):
+            if subscriber.policy == RESYNC:
+                subscriber.reset(self.bootstrap())
+                subscriber.resyncs += 1
+            else:
+                subscriber.dropped += 1
+        else:
+            subscriber.frames.append(frame)
+        if subscriber.wakeup is not None:
+            subscriber.wakeup()
+
+    def bootstrap(self):
+        # Cached until either the session frames or the tracked state change,
+        # so a burst of resyncs encodes the world only once.
+        snapshot = self.tracker.snapshot()
+        key = (self._session_version, snapshot.version)
+        if self._bootstrap is None or self._bootstrap[0] != key:
+            frames = [self.session[slot] for slot in SESSION if slot in self.session]
+            frames.extend(encode_world(snapshot.values(), provenance=self.provenance))
+            self._bootstrap = (key, frames)
+        return self._bootstrap[1]
+
+    def subscribe(self, wakeup=None, maxlen=None, policy=None):
+        subscriber = Subscriber(self.maxlen if maxlen is None else maxlen,
+                                self.policy if policy is None else policy,
+                                wakeup)
+        subscriber.reset(self.bootstrap())
+        if self.closed:
+            subscriber.closed = True
+        else:
+            self.subscribers.append(subscriber)
+        if wakeup is not None:
+            wakeup()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        try:
+            self.subscribers.remove(subscriber)
+        except ValueError:
+            pass
+
+    def close(self):
+        self.closed = True
+        for subscriber in self.subscribers:
+            subscriber.closed = True
+            if subscriber.wakeup is not None:
+                subscriber.wakeup()
+        self.subscribers = []
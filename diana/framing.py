@@ -0,0 +1,95 @@
+import struct
+import sys
+from . import metrics
+from .packet import decode_payload, packet_name
+from .enumerations import PacketProvenance
+
+MAGIC = b'\xef\xbe\xad\xde'
+HEADER = struct.Struct('<IIIIII')
+HEADER_SIZE = HEADER.size
+
+class Framer:
+    # Incremental framer over a reusable receive buffer. Bytes are written
+    # straight into the buffer (see reserve/commit), complete frames are cut
+    # out of it and the unconsumed tail is compacted only when space runs out.
+    def __init__(self, provenance=PacketProvenance.server, size=65536):
+        self.provenance = provenance
+        self.buffer = bytearray(size)
+        self.start = 0
+        self.end = 0
+        self.resyncs = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def reserve(self, size):
+        if self.start == self.end:
+            self.start = self.end = 0
+        if len(self.buffer) - self.end < size:
+            pending = self.end - self.start
+            if self.start:
+                self.buffer[:pending] = self.buffer[self.start:self.end]
+                self.start, self.end = 0, pending
+            if len(self.buffer) - self.end < size:
+                self.buffer.extend(bytes(max(size, len(self.buffer)) - (len(self.buffer) - self.end)))
+        return memoryview(self.buffer)[self.end:self.end + size]
+
+    def commit(self, size):
+        self.end += size
+
+    def feed(self, data):
+        size = len(data)
+        with self.reserve(size) as view:
+            view[:] = data
+        self.commit(size)
+
+    def _skip(self, count):
+        self.resyncs += 1
+        if metrics.registry is not None:
+            metrics.registry.inc('resyncs_total')
+            metrics.registry.inc('resync_bytes_total', None, count)
+        sys.stderr.write("WARNING: skipping {} bytes of stream to resync\n".format(count))
+        sys.stderr.flush()
+        self.start += count
+
+    def next_frame(self):
+        # Returns (packet type, frame bytes) for the next complete frame, or
+        # None if more data is needed.
+        buffer = self.buffer
+        while self.end - self.start >= HEADER_SIZE:
+            start = self.start
+            if buffer[start:start + 4] != MAGIC:
+                found = buffer.find(MAGIC, start, self.end)
+                if found == -1:
+                    # keep a possible partial magic number at the tail
+                    if self.end - start > 3:
+                        self._skip(self.end - start - 3)
+                    return None
+                self._skip(found - start)
+                continue
+            _magic, packet_len, origin, _padding, remaining, ptype = HEADER.unpack_from(buffer, start)
+            if (packet_len < HEADER_SIZE or remaining != packet_len - 20
+                                         or origin != self.provenance.value):
+                self._skip(1)
+                continue
+            if self.end - start < packet_len:
+                return None
+            self.start = start + packet_len
+            registry = metrics.registry
+            if registry is not None:
+                name = packet_name(ptype)
+                registry.inc('frames_total', name)
+                registry.inc('bytes_total', name, packet_len)
+            return ptype, bytes(buffer[start:start + packet_len])
+        return None
+
+    def frames(self):
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def packets(self):
+        for ptype, frame in self.frames():
+            yield decode_payload(ptype, frame[HEADER_SIZE:])
@@ -0,0 +1,63 @@
+from array import array
+
+TRAJECTORY_FIELDS = ('t', 'x', 'y', 'z', 'heading')
+
+class Trajectory:
+    # Fixed-size ring buffer of (t, x, y, z, heading) samples. Storage is a
+    # set of preallocated typed arrays, so appending never grows anything.
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('Trajectory capacity must be positive')
+        self.capacity = capacity
+        self.columns = {field: array('d', bytes(8 * capacity))
+                        for field in TRAJECTORY_FIELDS}
+        self._next = 0
+        self._count = 0
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def append(self, t, x, y, z, heading):
+        index = self._next
+        columns = self.columns
+        columns['t'][index] = t
+        columns['x'][index] = x
+        columns['y'][index] = y
+        columns['z'][index] = z
+        columns['heading'][index] = heading
+        self._next = (index + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def column(self, field):
+        data = self.columns[field]
+        if self._count < self.capacity:
+            return data[:self._count]
+        return data[self._next:] + data[:self._next]
+
+    def samples(self):
+        columns = [self.column(field) for field in TRAJECTORY_FIELDS]
+        return list(zip(*columns))
+
+    def latest(self):
+        if not self._count:
+            raise IndexError('Empty trajectory')
+        index = (self._next - 1) % self.capacity
+        return tuple(self.columns[field][index] for field in TRAJECTORY_FIELDS)
+
+    def velocity(self):
+        # Average velocity over the buffered window, as (vx, vy, vz).
+        if self._count < 2:
+            return (0.0, 0.0, 0.0)
+        last = (self._next - 1) % self.capacity
+        first = (self._next - self._count) % self.capacity
+        columns = self.columns
+        dt = columns['t'][last] - columns['t'][first]
+        if dt <= 0:
+            return (0.0, 0.0, 0.0)
+        return tuple((columns[field][last] - columns[field][first]) / dt
+                     for field in ('x', 'y', 'z'))
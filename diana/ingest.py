@@ -0,0 +1,96 @@
+from collections import deque
+import threading
+from . import packet as p
+
+MAX_EVENTS = 4096
+
+# Packets after which earlier pending object state is meaningless.
+BARRIERS = (p.GameStartPacket, p.GameEndPacket)
+
+# When the event queue is full these are shed first, then other events
+# oldest first; destroys and barriers are never dropped.
+SHEDDABLE = (p.HeartbeatPacket, p.NoisePacket)
+PRESERVED = (p.DestroyObjectPacket,) + BARRIERS
+
+def merge_records(pending, records):
+    # Folds object update records into a map of object id -> merged record;
+    # newer fields overwrite older ones.
+    for record in records:
+        try:
+            oid = record['object']
+        except KeyError:
+            continue
+        try:
+            pending[oid].update(record)
+        except KeyError:
+            pending[oid] = dict(record)
+
+class IngestBuffer:
+    # Sits between a network reader and a slow consumer (usually a Tracker).
+    # ObjectUpdate records are merged per object, so a consumer that falls
+    # behind gets the present state rather than a backlog of stale positions.
+    # Other packets are kept in order in a bounded event queue; destroys drop
+    # the destroyed object's pending update and game start/end drop all of
+    # them. The queue may exceed max_events only with destroys and barriers.
+    def __init__(self, max_events=MAX_EVENTS):
+        self.updates = {}
+        self.events = deque()
+        self.max_events = max_events
+        self.merged = 0
+        self.dropped = 0
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.updates) + len(self.events)
+
+    def put(self, received_packet):
+        with self._condition:
+            if isinstance(received_packet, p.ObjectUpdatePacket):
+                records = received_packet.records
+                before = len(self.updates)
+                merge_records(self.updates, records)
+                self.merged += len(records) - (len(self.updates) - before)
+            else:
+                if isinstance(received_packet, p.DestroyObjectPacket):
+                    self.updates.pop(received_packet.object, None)
+                elif isinstance(received_packet, BARRIERS):
+                    self.updates.clear()
+                if len(self.events) >= self.max_events and not self._shed(received_packet):
+                    self.dropped += 1
+                else:
+                    self.events.append(received_packet)
+            self._condition.notify()
+
+    def _shed(self, incoming):
+        # Makes room for `incoming`; returns False if it is the one to drop.
+        if isinstance(incoming, SHEDDABLE):
+            return False
+        events = self.events
+        victim = next((index for index, event in enumerate(events)
+                             if isinstance(event, SHEDDABLE)), None)
+        if victim is None:
+            victim = next((index for index, event in enumerate(events)
+                                 if not isinstance(event, PRESERVED)), None)
+        if victim is None:
+            return isinstance(incoming, PRESERVED)
+        del events[victim]
+        self.dropped += 1
+        return True
+
+    def take(self, timeout=None):
+        # Returns (events, records): pending discrete packets in arrival
+        # order, then the merged update records to apply after them.
+        with self._condition:
+            if not self.updates and not self.events:
+                self._condition.wait(timeout)
+            events, self.events = list(self.events), deque()
+            updates, self.updates = self.updates, {}
+        return events, list(updates.values())
+
+    def drain_into(self, tracker, timeout=None):
+        events, records = self.take(timeout)
+        for event in events:
+            tracker.rx(event)
+        if records:
+            tracker.update_records(records)
+        return len(events) + len(records)
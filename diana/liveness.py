@@ -0,0 +1,80 @@
+import time
+from . import packet
+
+class LinkTimeout(ConnectionError):
+    pass
+
+class Liveness:
+    # Per-connection heartbeat and dead-peer bookkeeping. It owns no thread
+    # or timer: clients ask it how long they may wait (wait), whether to send
+    # a heartbeat (heartbeat_due) and whether the peer is gone (expired).
+    #
+    # Artemis heartbeats are not echoed, so rtt is approximated as the time
+    # from our last heartbeat to the next inbound heartbeat.
+    def __init__(self, interval=3.0, timeout=10.0, clock=time.monotonic):
+        self.interval = interval
+        self.timeout = timeout
+        self.clock = clock
+        self.reset()
+
+    def reset(self, now=None):
+        if now is None:
+            now = self.clock()
+        self.last_received = now
+        self.last_sent = now
+        self.rtt = None
+        self.heartbeats_sent = 0
+        self._probe = None
+
+    def received(self, received_packet=None, now=None):
+        if now is None:
+            now = self.clock()
+        self.last_received = now
+        if self._probe is not None and isinstance(received_packet, packet.HeartbeatPacket):
+            self.rtt = now - self._probe
+            self._probe = None
+
+    def sent(self, heartbeat=False, now=None):
+        if now is None:
+            now = self.clock()
+        self.last_sent = now
+        if heartbeat:
+            self.heartbeats_sent += 1
+            if self._probe is None:
+                self._probe = now
+
+    def staleness(self, now=None):
+        if now is None:
+            now = self.clock()
+        return now - self.last_received
+
+    def heartbeat_due(self, now=None):
+        if now is None:
+            now = self.clock()
+        return now - self.last_sent >= self.interval
+
+    def expired(self, now=None):
+        return self.staleness(now) > self.timeout
+
+    def wait(self, now=None):
+        # Seconds until the next heartbeat or deadline needs attention.
+        if now is None:
+            now = self.clock()
+        return max(0.0, min(self.last_sent + self.interval,
+                            self.last_received + self.timeout) - now)
+
+    def check(self, send, now=None):
+        # Sends a heartbeat through send() if one is due and raises
+        # LinkTimeout if the peer has been silent past the deadline.
+        if now is None:
+            now = self.clock()
+        if self.expired(now):
+            raise LinkTimeout('No data received for {:.1f}s'.format(self.staleness(now)))
+        if self.heartbeat_due(now):
+            send(packet.HeartbeatPacket())
+            self.sent(heartbeat=True, now=now)
+
+    def metrics(self, now=None):
+        return {'rtt': self.rtt,
+                'staleness': self.staleness(now),
+                'heartbeats_sent': self.heartbeats_sent}
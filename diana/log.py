@@ -0,0 +1,93 @@
+import queue
+import sys
+import threading
+from . import packet
+from .framing import HEADER_SIZE
+
+DEFAULT_MAXSIZE = 4096
+DEFAULT_BATCH = 256
+
+_STOP = object()
+
+def format_frame(ptype, frame):
+    return str(packet.decode_payload(ptype, frame[HEADER_SIZE:]))
+
+class PacketLog:
+    # Records are queued as they are and only formatted on the writer thread,
+    # so callers never pay for decoding, str() or a slow output stream. Each
+    # wakeup drains up to `batch` records into a single write and flush. When
+    # the queue is full the record is dropped and counted instead of blocking.
+    #
+    # sample maps a packet class or packet id to N, logging one in every N
+    # packets of that kind (0 silences it); undecoded frames are matched by
+    # the class registered for their id, so game messages share one entry.
+    # truncate caps each line's length.
+    def __init__(self, stream=sys.stdout, maxsize=DEFAULT_MAXSIZE, batch=DEFAULT_BATCH,
+                 sample=None, truncate=None):
+        self.stream = stream
+        self.batch = batch
+        self.sample = dict(sample or {})
+        self.truncate = truncate
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.written = 0
+        self._seen = {}
+        self.writer = threading.Thread(target=self._write, name='diana-log', daemon=True)
+        self.writer.start()
+
+    def _sampled(self, kind, packet_id):
+        rate = self.sample.get(kind, self.sample.get(packet_id, 1))
+        if rate == 1:
+            return True
+        if not rate:
+            return False
+        seen = self._seen.get(kind, 0)
+        self._seen[kind] = seen + 1
+        return seen % rate == 0
+
+    def _put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def log(self, tag, pkt):
+        if self._sampled(type(pkt), getattr(pkt, 'packet_id', None)):
+            self._put((tag, pkt, None))
+
+    def log_frame(self, tag, ptype, frame):
+        if self._sampled(packet.PACKETS.get(ptype, ptype), ptype):
+            self._put((tag, ptype, frame))
+
+    def _format(self, tag, item, frame):
+        try:
+            text = str(item) if frame is None else format_frame(item, frame)
+        except Exception as e:
+            text = '<unformattable {!r}>'.format(e)
+        if self.truncate is not None and len(text) > self.truncate:
+            text = text[:self.truncate] + '...'
+        if tag is None:
+            return text + '\n'
+        return '{} {}\n'.format(tag, text)
+
+    def _write(self):
+        while True:
+            records = [self.queue.get()]
+            while len(records) < self.batch:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in records
+            lines = [self._format(*record) for record in records if record is not _STOP]
+            if lines:
+                self.stream.write(''.join(lines))
+                self.stream.flush()
+                self.written += len(lines)
+            if stop:
+                return
+
+    def close(self):
+        # Blocks until everything queued so far has been written.
+        self.queue.put(_STOP)
+        self.writer.join()
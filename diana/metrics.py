@@ -0,0 +1,120 @@
+import math
+import threading
+import time
+
+# The active registry, or None when metrics are disabled. Instrumented code
+# reads this once and skips all bookkeeping when it is None.
+registry = None
+
+def enable(clock=time.perf_counter):
+    global registry
+    if registry is None:
+        registry = Metrics(clock)
+    return registry
+
+def disable():
+    global registry
+    registry = None
+
+class Histogram:
+    # Power-of-two buckets: a value lands in the smallest 2**n >= value.
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            if mantissa == 0.5:
+                # exact power of two
+                exponent -= 1
+        else:
+            exponent = 0
+        self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for exponent in sorted(self.buckets):
+            total += self.buckets[exponent]
+            yield 2.0 ** exponent, total
+
+def _escape(label):
+    return label.replace('\\', '\\\\').replace('"', '\\"')
+
+class Metrics:
+    # Counters, gauges and histograms keyed by (name, label); the label is
+    # usually a packet class name and is exported as type="...".
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, label=None, value=1):
+        key = (name, label)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, label, value):
+        with self._lock:
+            self.gauges[(name, label)] = value
+
+    def observe(self, name, label, value):
+        key = (name, label)
+        with self._lock:
+            try:
+                histogram = self.histograms[key]
+            except KeyError:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def as_dict(self):
+        with self._lock:
+            result = {}
+            for (name, label), value in self.counters.items():
+                result.setdefault(name, {})[label] = value
+            for (name, label), value in self.gauges.items():
+                result.setdefault(name, {})[label] = value
+            for (name, label), histogram in self.histograms.items():
+                result.setdefault(name, {})[label] = {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'buckets': dict(histogram.cumulative()),
+                }
+            return result
+
+    def prometheus(self, prefix='diana_'):
+        def series(name, label, extra=''):
+            labels = [] if label is None else ['type="{}"'.format(_escape(label))]
+            if extra:
+                labels.append(extra)
+            if not labels:
+                return prefix + name
+            return '{}{}{{{}}}'.format(prefix, name, ','.join(labels))
+
+        def ordered(table):
+            return sorted(table.items(), key=lambda item: (item[0][0], str(item[0][1])))
+
+        lines = []
+        with self._lock:
+            last = None
+            for kind, table in (('counter', self.counters), ('gauge', self.gauges)):
+                for (name, label), value in ordered(table):
+                    if name != last:
+                        lines.append('# TYPE {}{} {}'.format(prefix, name, kind))
+                        last = name
+                    lines.append('{} {}'.format(series(name, label), value))
+            for (name, label), histogram in ordered(self.histograms):
+                if name != last:
+                    lines.append('# TYPE {}{} histogram'.format(prefix, name))
+                    last = name
+                for bound, total in histogram.cumulative():
+                    lines.append('{} {}'.format(series(name + '_bucket', label, 'le="{!r}"'.format(bound)), total))
+                lines.append('{} {}'.format(series(name + '_bucket', label, 'le="+Inf"'), histogram.count))
+                lines.append('{} {!r}'.format(series(name + '_sum', label), histogram.sum))
+                lines.append('{} {}'.format(series(name + '_count', label), histogram.count))
+        return ''.join(line + '\n' for line in lines)
@@ -1,4 +1,5 @@
-from .encoding import decode as unpack
+from .encoding import decode as unpack, encode as pack
+from enum import Enum
 from .enumerations import *
 
 def unscramble_elites(field):
@@ -524,3 +525,105 @@ def decode_obj_update_packet(packet):
         entries.append(obj)
     return entries
 
+
+def _raw(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (set, frozenset)):
+        return sum(member.value for member in value)
+    return value
+
+def _xyz(*extra):
+    return [('x', 'f'), ('y', 'f'), ('z', 'f')] + list(extra)
+
+# Field slots for each object type in bit order; None marks bits whose data
+# the decoder skips, so they are never set when encoding.
+OBJECT_FIELDS = {
+    ObjectType.player_vessel: (5, [
+        ('tgt-weapons', 'I'), ('impulse', 'f'), ('rudder', 'f'), ('top-speed', 'f'),
+        ('turn-rate', 'f'), ('auto-beams', 'B'), ('warp', 'B'), ('energy', 'f'),
+        ('shields-state', 's'), ('index', 'I'), ('vtype', 'I'), ('x', 'f'),
+        ('y', 'f'), ('z', 'f'), ('pitch', 'f'), ('roll', 'f'),
+        ('heading', 'f'), ('speed', 'f'), None, ('name', 'u'),
+        ('shields', 'f'), ('shields-max', 'f'), ('shields-aft', 'f'), ('shields-aft-max', 'f'),
+        ('docked', 'I'), ('red-alert', 'B'), None, ('main-view', 'B'),
+        ('beam-frequency', 'B'), ('coolant-avail', 'B'), ('tgt-science', 'I'), ('tgt-captain', 'I'),
+        ('drive-type', 'B'), ('tgt-scan', 'I'), ('scan-progress', 'f'), ('reverse', 'B')]),
+    ObjectType.weapons_console: (3, [
+        ('store-missile', 'B'), ('store-nuke', 'B'), ('store-mine', 'B'), ('store-emp', 'B'),
+        None, ('load-time-0', 'f'), ('load-time-1', 'f'), ('load-time-2', 'f'),
+        ('load-time-3', 'f'), ('load-time-4', 'f'), ('load-time-5', 'f')] +
+        [('status-{}'.format(n), 'B') for n in range(6)] +
+        [('contents-{}'.format(n), 'B') for n in range(6)]),
+    ObjectType.other_ship: (6, [
+        ('name', 'u'), None, ('rudder', 'f'), ('max-impulse', 'f'),
+        ('max-turn-rate', 'f'), ('iff-friendly', 'I', lambda friendly: int(not friendly)),
+        ('vtype', 'I'), ('x', 'f'),
+        ('y', 'f'), ('z', 'f'), ('pitch', 'f'), ('roll', 'f'),
+        ('heading', 'f'), ('speed', 'f'), ('surrender', 'B'), None,
+        ('shields', 'f'), ('shields-max', 'f'), ('shields-aft', 'f'), ('shields-aft-max', 'f'),
+        None, None, ('elite', 'I'), ('elite-active', 'I'),
+        ('scanned', 'I'), ('iff-side', 'I'), None, None, None, None, None, None,
+        None, None, ('damage-beams', 'f'), ('damage-tubes', 'f'),
+        ('damage-sensors', 'f'), ('damage-maneuvering', 'f'), ('damage-impulse', 'f'), ('damage-warp', 'f'),
+        ('damage-shields', 'f'), None] +
+        [('shields-{}'.format(n), 'f') for n in range(5)]),
+    ObjectType.base: (2, [
+        ('name', 'u'), ('shields', 'f'), ('shields-aft', 'f'), ('index', 'I'),
+        ('vtype', 'I'), ('x', 'f'), ('y', 'f'), ('z', 'f')]),
+    ObjectType.mine: (1, _xyz()),
+    ObjectType.anomaly: (1, _xyz(('name', 'u'))),
+    ObjectType.nebula: (1, _xyz(('red', 'f'), ('green', 'f'), ('blue', 'f'))),
+    ObjectType.torpedo: (1, _xyz()),
+    ObjectType.blackhole: (1, _xyz()),
+    ObjectType.asteroid: (1, _xyz()),
+    ObjectType.monster: (1, _xyz(('name', 'u'))),
+    ObjectType.whale: (2, [
+        ('name', 'u'), None, None, ('x', 'f'), ('y', 'f'), ('z', 'f'),
+        ('pitch', 'f'), ('roll', 'f'), ('heading', 'f')]),
+    ObjectType.drone: (2, [
+        None, ('x', 'f'), None, ('z', 'f'), None, ('y', 'f'), ('heading', 'f')]),
+}
+
+ENGINEERING_SYSTEMS = ('beams', 'torps', 'sensors', 'maneuvering',
+                       'impulse', 'warp', 'shields', 'shields-aft')
+
+def _encode_engineering(obj):
+    # The decoder reads all three blocks against the heat mask, so only
+    # systems with heat, energy and coolant all known can be sent.
+    mask = 0
+    heat, energy, coolant = [], [], []
+    for bit, system in enumerate(ENGINEERING_SYSTEMS):
+        keys = ('heat-' + system, 'energy-' + system, 'coolant-' + system)
+        if all(key in obj for key in keys):
+            mask |= 1 << bit
+            heat.append(pack('f', [obj[keys[0]]]))
+            energy.append(pack('f', [obj[keys[1]]]))
+            coolant.append(pack('B', [obj[keys[2]]]))
+    return (pack('BIBBBB', [ObjectType.engineering_console.value, obj['object'],
+                            mask, mask, mask, 0]) +
+            b''.join(heat + energy + coolant))
+
+def encode_obj_update_entry(obj):
+    object_type = obj.get('type')
+    if object_type == ObjectType.engineering_console:
+        return _encode_engineering(obj)
+    try:
+        nbytes, slots = OBJECT_FIELDS[object_type]
+    except KeyError:
+        raise ValueError('Cannot encode object type {!r}'.format(object_type))
+    masks = [0] * nbytes
+    values = []
+    for bit, slot in enumerate(slots):
+        if slot is None or slot[0] not in obj:
+            continue
+        masks[bit // 8] |= 1 << (bit % 8)
+        convert = slot[2] if len(slot) > 2 else _raw
+        values.append(pack(slot[1], [convert(obj[slot[0]])]))
+    return (pack('BI' + 'B' * nbytes, [object_type.value, obj['object']] + masks) +
+            b''.join(values))
+
+def encode_obj_update_packet(records):
+    return b''.join(encode_obj_update_entry(obj) for obj in records) + b'\x00\x00\x00\x00'
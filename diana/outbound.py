@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from itertools import count
+from . import packet
+
+# Packets whose latest value supersedes any still-pending earlier one, with
+# the attribute (if any) that distinguishes independent values. Relative
+# inputs such as ClimbDivePacket (a +/-1 nudge) are not setpoints and are
+# always sent.
+COALESCED = {
+    packet.HelmSetSteeringPacket: None,
+    packet.HelmSetImpulsePacket: None,
+    packet.HelmSetWarpPacket: None,
+    packet.SetMainScreenPacket: None,
+    packet.SetBeamFreqPacket: None,
+    packet.SetWeaponsTargetPacket: None,
+    packet.SciSelectPacket: None,
+    packet.CaptainSelectPacket: None,
+    packet.GameMasterSelectPacket: None,
+    packet.SetConsolePacket: 'console',
+}
+
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+PRIORITIES = {
+    packet.ToggleShieldsPacket: HIGH,
+    packet.ToggleRedAlertPacket: HIGH,
+    packet.HelmJumpPacket: HIGH,
+    packet.HelmRequestDockPacket: HIGH,
+    packet.HelmToggleReversePacket: HIGH,
+    packet.SciSelectPacket: LOW,
+    packet.SciScanPacket: LOW,
+    packet.CaptainSelectPacket: LOW,
+    packet.GameMasterSelectPacket: LOW,
+    packet.TogglePerspectivePacket: LOW,
+}
+
+class QueueFull(RuntimeError):
+    pass
+
+DROP_NEWEST = 'newest'
+DROP_LOWEST = 'lowest'
+DROP_ERROR = 'error'
+
+class SendQueue:
+    # Collects outbound packets and writes them in a single call per flush.
+    # A pending "latest value wins" command is dropped when a newer one of
+    # the same kind arrives. Higher priority classes are written first, and
+    # each class is sent in submission order.
+    #
+    # When maxlen is set and the queue is full, the drop policy decides:
+    #   DROP_NEWEST  discard the incoming packet
+    #   DROP_LOWEST  evict the oldest packet of the lowest priority class no
+    #                more important than the incoming one (else discard it)
+    #   DROP_ERROR   raise QueueFull
+    def __init__(self, write=None, provenance=packet.PacketProvenance.client,
+                 coalesced=COALESCED, priorities=PRIORITIES,
+                 maxlen=None, policy=DROP_LOWEST):
+        self.write = write
+        self.provenance = provenance
+        self.coalesced = coalesced
+        self.priorities = priorities
+        self.maxlen = maxlen
+        self.policy = policy
+        self.classes = [OrderedDict() for _ in range(LOW + 1)]
+        self.slots = {}
+        self.dropped = 0
+        self._ids = count()
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.classes)
+
+    def _evict_for(self, priority):
+        for lower in range(LOW, priority - 1, -1):
+            entries = self.classes[lower]
+            if entries:
+                _entry, (key, _pack) = entries.popitem(last=False)
+                if key is not None:
+                    del self.slots[key]
+                return True
+        return False
+
+    def put(self, pack):
+        cls = type(pack)
+        priority = self.priorities.get(cls, NORMAL)
+        key = None
+        if cls in self.coalesced:
+            attribute = self.coalesced[cls]
+            key = (cls, None if attribute is None else getattr(pack, attribute))
+            previous = self.slots.pop(key, None)
+            if previous is not None:
+                old_priority, old_entry = previous
+                del self.classes[old_priority][old_entry]
+        if self.maxlen is not None and len(self) >= self.maxlen:
+            if self.policy == DROP_ERROR:
+                raise QueueFull('Outbound queue is full')
+            if self.policy == DROP_NEWEST or not self._evict_for(priority):
+                self.dropped += 1
+                return False
+            self.dropped += 1
+        entry = next(self._ids)
+        self.classes[priority][entry] = (key, pack)
+        if key is not None:
+            self.slots[key] = (priority, entry)
+        return True
+
+    def take(self, max_bytes=None):
+        # With max_bytes, stops before the first packet that would exceed the
+        # budget (but always sends at least one), leaving the rest queued.
+        chunks = []
+        size = 0
+        for entries in self.classes:
+            while entries:
+                entry, (key, pack) = next(iter(entries.items()))
+                data = packet.encode(pack, provenance=self.provenance)
+                if max_bytes is not None and chunks and size + len(data) > max_bytes:
+                    return b''.join(chunks)
+                del entries[entry]
+                if key is not None:
+                    del self.slots[key]
+                chunks.append(data)
+                size += len(data)
+        return b''.join(chunks)
+
+    def flush(self, max_bytes=None):
+        data = self.take(max_bytes)
+        if data:
+            self.write(data)
+        return len(data)
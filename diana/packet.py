@@ -1,6 +1,7 @@
 import struct
 import sys
 import math
+from . import metrics
 from .encoding import encode as base_pack, decode as unpack
 from .object_update import decode_obj_update_packet
 from .enumerations import *
@@ -20,6 +21,14 @@ def packet(n):
         return cls
     return wrapper
 
+def subpacket(n):
+    # Registers a subtype (the first payload byte) with its parent packet.
+    def wrapper(cls):
+        cls.SUBPACKETS[n] = cls
+        cls.subtype = n
+        return cls
+    return wrapper
+
 class UndecodedPacket:
     def __init__(self, packet_id, data):
         self.packet_id = packet_id
@@ -170,17 +179,27 @@ class CommsIncomingPacket:
 class ObjectUpdatePacket:
     def __init__(self, raw_data):
         self.raw_data = raw_data
+        self._decoded = None
 
     @property
     def _records(self):
-        return decode_obj_update_packet(self.raw_data)
+        registry = metrics.registry
+        if registry is None:
+            return decode_obj_update_packet(self.raw_data)
+        start = registry.clock()
+        records = decode_obj_update_packet(self.raw_data)
+        registry.observe('object_update_decode_seconds', None, registry.clock() - start)
+        registry.inc('object_update_records_total', None, len(records))
+        return records
 
     @property
     def records(self):
-        try:
-            return self._records
-        except Exception:
-            return []
+        if self._decoded is None:
+            try:
+                self._decoded = self._records
+            except Exception:
+                self._decoded = []
+        return self._decoded
 
     @classmethod
     def decode(cls, packet):
@@ -193,8 +212,10 @@ class ObjectUpdatePacket:
 
     def __str__(self):
         try:
-            records = repr(self._records)
-            return '<ObjectUpdatePacket records={}>'.format(records)
+            if not self._decoded:
+                # reuse records already decoded by a consumer
+                self._decoded = self._records
+            return '<ObjectUpdatePacket records={!r}>'.format(self._decoded)
         except Exception as e:
             return '<ObjectUpdatePacket data={0!r} error={1!r}>'.format(self.raw_data, e)
 
@@ -227,31 +248,19 @@ class DestroyObjectPacket:
 
 @packet(0xf754c8fe)
 class GameMessagePacket:
+    SUBPACKETS = {}
+
     @classmethod
     def decode(cls, packet):
         if not packet:
             raise ValueError('No payload in game message')
-        subtype_index = packet[0]
-        if subtype_index == 0:
-            return GameStartPacket.decode(packet)
-        if subtype_index == 6:
-            return GameEndPacket.decode(packet)
-        if subtype_index == 9:
-            return SkyboxPacket.decode(packet)
-        if subtype_index == 10:
-            return PopupPacket.decode(packet)
-        if subtype_index == 11:
-            return AutonomousDamconPacket.decode(packet)
-        if subtype_index == 12:
-            return JumpStartPacket.decode(packet)
-        if subtype_index == 13:
-            return JumpEndPacket.decode(packet)
-        if subtype_index == 15:
-            return AllShipSettingsPacket.decode(packet)
-        if subtype_index == 16:
-            return DmxPacket.decode(packet)
-        raise SoftDecodeFailure()
+        try:
+            subpacket = cls.SUBPACKETS[packet[0]]
+        except KeyError:
+            raise SoftDecodeFailure()
+        return subpacket.decode(packet)
 
+@subpacket(0)
 class GameStartPacket(GameMessagePacket):
     def encode(self):
         return b'\x00\x00\x00\x00\x0a\x00\x00\x00\x00\x00\x00\x00'
@@ -265,6 +274,7 @@ class GameStartPacket(GameMessagePacket):
     def __str__(self):
         return '<GameStartPacket>'
 
+@subpacket(6)
 class GameEndPacket(GameMessagePacket):
     def encode(self):
         return b'\x06\x00\x00\x00'
@@ -278,6 +288,7 @@ class GameEndPacket(GameMessagePacket):
     def __str__(self):
         return '<GameEndPacket>'
 
+@subpacket(15)
 class AllShipSettingsPacket(GameMessagePacket):
     def __init__(self, ships):
         self.ships = list(ships)
@@ -298,6 +309,7 @@ class AllShipSettingsPacket(GameMessagePacket):
     def __str__(self):
         return '<AllShipSettingsPacket settings={0!r}>'.format(self.ships)
 
+@subpacket(12)
 class JumpStartPacket(GameMessagePacket):
     def encode(self):
         return b'\x0c\x00\x00\x00'
@@ -311,6 +323,7 @@ class JumpStartPacket(GameMessagePacket):
     def __str__(self):
         return '<JumpStartPacket>'
 
+@subpacket(13)
 class JumpEndPacket(GameMessagePacket):
     def encode(self):
         return b'\x0d\x00\x00\x00'
@@ -324,6 +337,7 @@ class JumpEndPacket(GameMessagePacket):
     def __str__(self):
         return '<JumpEndPacket>'
 
+@subpacket(16)
 class DmxPacket(GameMessagePacket):
     def __init__(self, flag, state):
         self.flag = flag
@@ -340,6 +354,7 @@ class DmxPacket(GameMessagePacket):
     def __str__(self):
         return '<DmxPacket flag={0!r} state={1!r}>'.format(self.flag, self.state)
 
+@subpacket(9)
 class SkyboxPacket(GameMessagePacket):
     def __init__(self, skybox):
         self.skybox = skybox
@@ -355,6 +370,7 @@ class SkyboxPacket(GameMessagePacket):
     def __str__(self):
         return '<SkyboxPacket skybox={0!r}>'.format(self.skybox)
 
+@subpacket(10)
 class PopupPacket(GameMessagePacket):
     def __init__(self, message):
         self.message = message
@@ -370,6 +386,7 @@ class PopupPacket(GameMessagePacket):
     def __str__(self):
         return '<PopupPacket message={0!r}>'.format(self.message)
 
+@subpacket(11)
 class AutonomousDamconPacket(GameMessagePacket):
     def __init__(self, autonomy):
         self.autonomy = autonomy
@@ -387,53 +404,19 @@ class AutonomousDamconPacket(GameMessagePacket):
 
 @packet(0x4c821d3c)
 class ShipAction1Packet:
+    SUBPACKETS = {}
+
     @classmethod
     def decode(cls, packet):
         if not packet:
             raise ValueError('No payload in game message')
-        subtype_index = packet[0]
-        if subtype_index == 0:
-            return HelmSetWarpPacket.decode(packet)
-        if subtype_index == 1:
-            return SetMainScreenPacket.decode(packet)
-        if subtype_index == 2:
-            return SetWeaponsTargetPacket.decode(packet)
-        if subtype_index == 3:
-            return ToggleAutoBeamsPacket.decode(packet)
-        if subtype_index == 4:
-            return ToggleShieldsPacket.decode(packet)
-        if subtype_index == 7:
-            return HelmRequestDockPacket.decode(packet)
-        if subtype_index == 10:
-            return ToggleRedAlertPacket.decode(packet)
-        if subtype_index == 11:
-            return SetBeamFreqPacket.decode(packet)
-        if subtype_index == 13:
-            return SetShipPacket.decode(packet)
-        if subtype_index == 14:
-            return SetConsolePacket.decode(packet)
-        if subtype_index == 15:
-            return ReadyPacket.decode(packet)
-        if subtype_index == 16:
-            return SciSelectPacket.decode(packet)
-        if subtype_index == 17:
-            return CaptainSelectPacket.decode(packet)
-        if subtype_index == 18:
-            return GameMasterSelectPacket.decode(packet)
-        if subtype_index == 19:
-            return SciScanPacket.decode(packet)
-        if subtype_index == 22:
-            return SetShipSettingsPacket.decode(packet)
-        if subtype_index == 24:
-            return HelmToggleReversePacket.decode(packet)
-        if subtype_index == 25:
-            return Ready2Packet.decode(packet)
-        if subtype_index == 26:
-            return TogglePerspectivePacket.decode(packet)
-        if subtype_index == 27:
-            return ClimbDivePacket.decode(packet)
-        raise SoftDecodeFailure()
+        try:
+            subpacket = cls.SUBPACKETS[packet[0]]
+        except KeyError:
+            raise SoftDecodeFailure()
+        return subpacket.decode(packet)
 
+@subpacket(19)
 class SciScanPacket(ShipAction1Packet):
     def __init__(self, target):
         self.target = target
@@ -449,6 +432,7 @@ class SciScanPacket(ShipAction1Packet):
     def __str__(self):
         return "<SciScanPacket target={0!r}>".format(self.target)
 
+@subpacket(17)
 class CaptainSelectPacket(ShipAction1Packet):
     def __init__(self, object):
         self.object = object
@@ -470,6 +454,7 @@ class CaptainSelectPacket(ShipAction1Packet):
     def __str__(self):
         return "<CaptainSelectPacket object={0!r}>".format(self.object)
 
+@subpacket(18)
 class GameMasterSelectPacket(ShipAction1Packet):
     def __init__(self, object):
         self.object = object
@@ -491,6 +476,7 @@ class GameMasterSelectPacket(ShipAction1Packet):
     def __str__(self):
         return "<GameMasterSelectPacket object={0!r}>".format(self.object)
 
+@subpacket(16)
 class SciSelectPacket(ShipAction1Packet):
     def __init__(self, object):
         self.object = object
@@ -512,6 +498,7 @@ class SciSelectPacket(ShipAction1Packet):
     def __str__(self):
         return "<SciSelectPacket object={0!r}>".format(self.object)
 
+@subpacket(2)
 class SetWeaponsTargetPacket(ShipAction1Packet):
     def __init__(self, object):
         self.object = object
@@ -533,6 +520,7 @@ class SetWeaponsTargetPacket(ShipAction1Packet):
     def __str__(self):
         return "<SetWeaponsTargetPacket object={0!r}>".format(self.object)
 
+@subpacket(11)
 class SetBeamFreqPacket(ShipAction1Packet):
     def __init__(self, freq):
         self.freq = freq
@@ -548,6 +536,7 @@ class SetBeamFreqPacket(ShipAction1Packet):
     def __str__(self):
         return "<SetBeamFreqPacket freq={}>".format(self.freq)
 
+@subpacket(24)
 class HelmToggleReversePacket(ShipAction1Packet):
     def encode(self):
         return b'\x18\x00\x00\x00\x00\x00\x00\x00'
@@ -561,6 +550,7 @@ class HelmToggleReversePacket(ShipAction1Packet):
     def __str__(self):
         return '<HelmToggleReversePacket>'
 
+@subpacket(15)
 class ReadyPacket(ShipAction1Packet):
     def encode(self):
         return b'\x0f\x00\x00\x00\x00\x00\x00\x00'
@@ -574,6 +564,7 @@ class ReadyPacket(ShipAction1Packet):
     def __str__(self):
         return '<ReadyPacket>'
 
+@subpacket(25)
 class Ready2Packet(ShipAction1Packet):
     def encode(self):
         return b'\x19\x00\x00\x00\x00\x00\x00\x00'
@@ -587,6 +578,7 @@ class Ready2Packet(ShipAction1Packet):
     def __str__(self):
         return '<Ready2Packet>'
 
+@subpacket(22)
 class SetShipSettingsPacket(ShipAction1Packet):
     def __init__(self, drive, type, name):
         self.drive = drive
@@ -606,6 +598,7 @@ class SetShipSettingsPacket(ShipAction1Packet):
     def __str__(self):
         return '<SetShipSettingsPacket drive={0!r} type={1!r} name={2!r}>'.format(self.drive, self.type, self.name)
 
+@subpacket(7)
 class HelmRequestDockPacket(ShipAction1Packet):
     def encode(self):
         return b'\x07\x00\x00\x00\x00\x00\x00\x00'
@@ -619,6 +612,7 @@ class HelmRequestDockPacket(ShipAction1Packet):
     def __str__(self):
         return '<HelmRequestDockPacket>'
 
+@subpacket(4)
 class ToggleShieldsPacket(ShipAction1Packet):
     def encode(self):
         return b'\x04\x00\x00\x00\x00\x00\x00\x00'
@@ -632,6 +626,7 @@ class ToggleShieldsPacket(ShipAction1Packet):
     def __str__(self):
         return '<ToggleShieldsPacket>'
 
+@subpacket(10)
 class ToggleRedAlertPacket(ShipAction1Packet):
     def encode(self):
         return b'\x0a\x00\x00\x00\x00\x00\x00\x00'
@@ -645,6 +640,7 @@ class ToggleRedAlertPacket(ShipAction1Packet):
     def __str__(self):
         return '<ToggleRedAlertPacket>'
 
+@subpacket(3)
 class ToggleAutoBeamsPacket(ShipAction1Packet):
     def encode(self):
         return b'\x03\x00\x00\x00\x00\x00\x00\x00'
@@ -658,6 +654,7 @@ class ToggleAutoBeamsPacket(ShipAction1Packet):
     def __str__(self):
         return '<ToggleAutoBeamsPacket>'
 
+@subpacket(26)
 class TogglePerspectivePacket(ShipAction1Packet):
     def encode(self):
         return b'\x1a\x00\x00\x00\x00\x00\x00\x00'
@@ -671,6 +668,7 @@ class TogglePerspectivePacket(ShipAction1Packet):
     def __str__(self):
         return '<TogglePerspectivePacket>'
 
+@subpacket(27)
 class ClimbDivePacket(ShipAction1Packet):
     def __init__(self, direction):
         self.direction = direction
@@ -686,6 +684,7 @@ class ClimbDivePacket(ShipAction1Packet):
     def __str__(self):
         return "<ClimbDivePacket direction={0!r}>".format(self.direction)
 
+@subpacket(1)
 class SetMainScreenPacket(ShipAction1Packet):
     def __init__(self, screen):
         self.screen = screen
@@ -701,6 +700,7 @@ class SetMainScreenPacket(ShipAction1Packet):
     def __str__(self):
         return "<SetMainScreenPacket screen={0!r}>".format(self.screen)
 
+@subpacket(14)
 class SetConsolePacket(ShipAction1Packet):
     def __init__(self, console, selected):
         self.console = console
@@ -717,6 +717,7 @@ class SetConsolePacket(ShipAction1Packet):
     def __str__(self):
         return "<SetConsolePacket console={0!r} selected={1!r}>".format(self.console, self.selected)
 
+@subpacket(0)
 class HelmSetWarpPacket(ShipAction1Packet):
     def __init__(self, warp):
         self.warp = warp
@@ -732,6 +733,7 @@ class HelmSetWarpPacket(ShipAction1Packet):
     def __str__(self):
         return "<HelmSetWarpPacket warp={}>".format(self.warp)
 
+@subpacket(13)
 class SetShipPacket(ShipAction1Packet):
     def __init__(self, ship):
         self.ship = ship
@@ -749,19 +751,19 @@ class SetShipPacket(ShipAction1Packet):
 
 @packet(0x0351a5ac)
 class ShipAction3Packet:
+    SUBPACKETS = {}
+
     @classmethod
     def decode(cls, packet):
         if not packet:
             raise ValueError('No payload in game message')
-        subtype_index = packet[0]
-        if subtype_index == 0:
-            return HelmSetImpulsePacket.decode(packet)
-        if subtype_index == 1:
-            return HelmSetSteeringPacket.decode(packet)
-        if subtype_index == 5:
-            return HelmJumpPacket.decode(packet)
-        raise SoftDecodeFailure()
+        try:
+            subpacket = cls.SUBPACKETS[packet[0]]
+        except KeyError:
+            raise SoftDecodeFailure()
+        return subpacket.decode(packet)
 
+@subpacket(1)
 class HelmSetSteeringPacket(ShipAction3Packet):
     def __init__(self, rudder):
         self.rudder = rudder
@@ -777,6 +779,7 @@ class HelmSetSteeringPacket(ShipAction3Packet):
     def __str__(self):
         return '<HelmSetSteeringPacket rudder={0!r}>'.format(self.rudder)
 
+@subpacket(0)
 class HelmSetImpulsePacket(ShipAction3Packet):
     def __init__(self, impulse):
         self.impulse = impulse
@@ -792,6 +795,7 @@ class HelmSetImpulsePacket(ShipAction3Packet):
     def __str__(self):
         return '<HelmSetImpulsePacket impulse={0!r}>'.format(self.impulse)
 
+@subpacket(5)
 class HelmJumpPacket(ShipAction3Packet):
     def __init__(self, bearing, distance):
         self.bearing = bearing
@@ -855,6 +859,8 @@ def decode(packet, provenance=PacketProvenance.server): # returns packets, trail
     if de_index > 0:
         sys.stderr.write("WARNING: skipping {} bytes of stream to resync\n".format(de_index))
         sys.stderr.flush()
+        if metrics.registry is not None:
+            metrics.registry.inc('resyncs_total')
         packet = packet[de_index:]
     elif de_index == -1:
         # wtf?
@@ -876,12 +882,30 @@ def decode(packet, provenance=PacketProvenance.server): # returns packets, trail
     trailer = packet[packet_len:]
     payload = packet[24:packet_len]
     rest, trailer = decode(trailer)
+    return [decode_payload(ptype, payload)] + rest, trailer
+
+def packet_name(ptype):
+    try:
+        return PACKETS[ptype].__name__
+    except KeyError:
+        return '0x{:08x}'.format(ptype)
+
+def decode_payload(ptype, payload):
+    registry = metrics.registry
+    if registry is None:
+        return _decode_payload(ptype, payload)
+    start = registry.clock()
+    decoded = _decode_payload(ptype, payload)
+    registry.observe('decode_seconds', type(decoded).__name__, registry.clock() - start)
+    return decoded
+
+def _decode_payload(ptype, payload):
     try:
         if ptype in PACKETS:
             # we know how to decode this one
-            return [PACKETS[ptype].decode(payload)] + rest, trailer
+            return PACKETS[ptype].decode(payload)
         else:
             raise SoftDecodeFailure()
     except SoftDecodeFailure: # meaning unhandled bits
-        return [UndecodedPacket(ptype, payload)] + rest, trailer
+        return UndecodedPacket(ptype, payload)
 
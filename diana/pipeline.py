@@ -0,0 +1,121 @@
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import socket
+import threading
+from . import packet
+from .framing import Framer, HEADER_SIZE
+
+DEFAULT_DEPTH = 1024
+BLOCKSIZE = 65536
+
+def decode_frame(ptype, frame):
+    decoded = packet.decode_payload(ptype, frame[HEADER_SIZE:])
+    if isinstance(decoded, packet.ObjectUpdatePacket):
+        # decode the records here, off the consumer's thread; they are cached
+        decoded.records
+    return decoded
+
+class _End:
+    def __init__(self, exception=None):
+        self.exception = exception
+
+class PipelinedReceiver:
+    # Reader thread -> decode pool -> in-order delivery.
+    #
+    # The reader only frames raw bytes and submits each frame to the pool,
+    # so recv is never held up by decoding. Futures are queued in arrival
+    # order in a bounded queue, which both preserves ordering and stops the
+    # reader when the consumer falls too far behind.
+    def __init__(self, sock, workers=4, depth=DEFAULT_DEPTH, executor=None,
+                 provenance=packet.PacketProvenance.server):
+        self.sock = sock
+        self.framer = Framer(provenance)
+        self.owns_executor = executor is None
+        self.executor = executor if executor is not None else ThreadPoolExecutor(workers)
+        self.pending = queue.Queue(maxsize=depth)
+        self.frames_read = 0
+        self.decoded = 0
+        self.delivered = 0
+        self._lock = threading.Lock()
+        self._finished = False
+        self._closed = False
+        self.reader = threading.Thread(target=self._read, name='diana-reader', daemon=True)
+        self.reader.start()
+
+    def _count_decoded(self, future):
+        with self._lock:
+            self.decoded += 1
+
+    def _read(self):
+        # as with connect()'s rx, the socket is closed however reading ends
+        end = _End()
+        try:
+            while not self._closed:
+                with self.framer.reserve(BLOCKSIZE) as view:
+                    received = self.sock.recv_into(view)
+                if not received:
+                    break
+                self.framer.commit(received)
+                for ptype, frame in self.framer.frames():
+                    future = self.executor.submit(decode_frame, ptype, frame)
+                    future.add_done_callback(self._count_decoded)
+                    self.frames_read += 1
+                    self.pending.put(future)
+        except Exception as e:
+            end = _End(e)
+        finally:
+            self.sock.close()
+        self.pending.put(end)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+        item = self.pending.get()
+        if isinstance(item, _End):
+            self._finished = True
+            if self.owns_executor:
+                self.executor.shutdown(wait=False)
+            if item.exception is not None:
+                raise item.exception
+            raise StopIteration
+        self.delivered += 1
+        return item.result()
+
+    def close(self):
+        # Stops the reader and releases the socket and an owned pool; for
+        # consumers that stop iterating before the peer disconnects.
+        if self._closed:
+            return
+        self._closed = True
+        self._finished = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        while self.reader.is_alive():
+            # unblock a reader waiting for room in the delivery queue
+            try:
+                self.pending.get(timeout=0.05)
+            except queue.Empty:
+                pass
+        if self.owns_executor:
+            self.executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def metrics(self):
+        with self._lock:
+            decoded = self.decoded
+        return {'frames_read': self.frames_read,
+                'decoded': decoded,
+                'delivered': self.delivered,
+                'decode_depth': self.frames_read - decoded,
+                'delivery_depth': self.pending.qsize()}
@@ -0,0 +1,119 @@
+import time
+from . import metrics, packet
+from .framing import HEADER_SIZE
+
+class Drop:
+    def __call__(self, frame, decoded, encode):
+        return []
+
+class Rewrite:
+    # changes is either a dict of attributes to set or a function taking the
+    # decoded packet and returning the packet to send in its place
+    def __init__(self, changes):
+        self.changes = changes
+
+    def __call__(self, frame, decoded, encode):
+        pkt = decoded()
+        if callable(self.changes):
+            pkt = self.changes(pkt)
+        else:
+            for field, value in self.changes.items():
+                setattr(pkt, field, value)
+        return [] if pkt is None else [encode(pkt)]
+
+class RateLimit:
+    # Token bucket; packets over the limit are dropped.
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.last = None
+
+    def __call__(self, frame, decoded, encode):
+        now = self.clock()
+        if self.last is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return []
+        self.tokens -= 1
+        return [frame]
+
+class Inject:
+    # Sends extra packets before or after the matched one.
+    def __init__(self, packets, before=False):
+        self.packets = list(packets)
+        self.before = before
+
+    def __call__(self, frame, decoded, encode):
+        extra = [encode(pkt) for pkt in self.packets]
+        return extra + [frame] if self.before else [frame] + extra
+
+class Rule:
+    # Matches packets by class, or by packet id and optional subtype. A class
+    # with a subtype (see packet.subpacket) matches only that subtype; its
+    # parent matches them all. where maps attribute names to a value or a
+    # predicate, and forces a decode of matching packet types.
+    def __init__(self, match, action, subtype=None, where=None):
+        if isinstance(match, int):
+            self.packet_id = match
+            self.subtype = subtype
+        else:
+            self.packet_id = match.packet_id
+            self.subtype = match.__dict__.get('subtype', subtype)
+        self.action = action
+        self.where = dict(where or {})
+
+    def matches(self, pkt):
+        for field, expected in self.where.items():
+            try:
+                value = getattr(pkt, field)
+            except AttributeError:
+                return False
+            if callable(expected):
+                if not expected(value):
+                    return False
+            elif value != expected:
+                return False
+        return True
+
+class RuleSet:
+    # Rules compile into a table keyed on packet id, then subtype (None for
+    # rules covering every subtype). Frames whose id has no rules are passed
+    # through without being decoded; otherwise the first matching rule's
+    # action decides what is sent in place of the frame.
+    def __init__(self, rules, provenance=packet.PacketProvenance.client):
+        self.provenance = provenance
+        self.table = {}
+        for rule in rules:
+            self.table.setdefault(rule.packet_id, {}).setdefault(rule.subtype, []).append(rule)
+        self.matched = 0
+
+    def _candidates(self, ptype, frame):
+        by_subtype = self.table[ptype]
+        subtype = frame[HEADER_SIZE] if len(frame) > HEADER_SIZE else None
+        specific = by_subtype.get(subtype, ()) if subtype is not None else ()
+        return list(specific) + list(by_subtype.get(None, ()))
+
+    def _encode(self, pkt):
+        return packet.encode(pkt, provenance=self.provenance)
+
+    def apply(self, ptype, frame):
+        if ptype not in self.table:
+            return [frame]
+        cache = []
+
+        def decoded():
+            if not cache:
+                cache.append(packet.decode_payload(ptype, frame[HEADER_SIZE:]))
+            return cache[0]
+
+        for rule in self._candidates(ptype, frame):
+            if rule.where and not rule.matches(decoded()):
+                continue
+            self.matched += 1
+            if metrics.registry is not None:
+                metrics.registry.inc('rules_matched_total', packet.packet_name(ptype))
+            return rule.action(frame, decoded, self._encode)
+        return [frame]
@@ -1,19 +1,280 @@
+import random
+import selectors
 import socket
+import time
 from . import packet
+from .framing import Framer
+from .outbound import SendQueue
+from .liveness import LinkTimeout
+from .pipeline import PipelinedReceiver
 
-BLOCKSIZE = 4096
+MIN_BLOCKSIZE = 4096
+MAX_BLOCKSIZE = 262144
+FLUSH_INTERVAL = 0.05
+# settimeout(0) would make the socket non-blocking, so waits are clamped
+MIN_TIMEOUT = 0.001
 
-def connect(host, port=2010, connect=socket.create_connection):
+def connect(host, port=2010, connect=socket.create_connection, queue=None,
+            liveness=None, decode_workers=None, flush_interval=FLUSH_INTERVAL):
+    # With a SendQueue, tx() only enqueues; pending packets are written in
+    # one call before each read, or whenever queue.flush() is called. Reads
+    # then time out after flush_interval, so while rx is being iterated a
+    # queued packet waits at most flush_interval even on a quiet link.
+    # With a Liveness, reads time out so heartbeats can be sent and a silent
+    # peer raises LinkTimeout from the rx generator.
+    # With decode_workers, rx is a PipelinedReceiver that frames on a reader
+    # thread and decodes on a thread pool; its reads never return to this
+    # thread, so it cannot be combined with queue or liveness.
+    if decode_workers is not None and (queue is not None or liveness is not None):
+        raise ValueError('decode_workers cannot be combined with queue or liveness')
     sock = connect((host, port))
-    def tx(pack):
-        sock.send(packet.encode(pack))
+    def send_now(pack):
+        sock.sendall(packet.encode(pack))
+    if queue is None:
+        def tx(pack):
+            sock.send(packet.encode(pack))
+    else:
+        if queue.write is None:
+            queue.write = sock.sendall
+        tx = queue.put
     def rx():
-        buf = b''
-        while True:
-            data = sock.recv(BLOCKSIZE)
-            buf += data
-            packets, buf = packet.decode(data)
-            for received_packet in packets:
-                yield received_packet
+        framer = Framer()
+        blocksize = MIN_BLOCKSIZE
+        if liveness is not None:
+            liveness.reset()
+        # the socket is closed however reading ends: EOF, an error, a link
+        # timeout or the consumer closing the generator
+        try:
+            while True:
+                timeout = None
+                if queue is not None:
+                    queue.flush()
+                    timeout = flush_interval
+                if liveness is not None:
+                    liveness.check(send_now)
+                    wait = liveness.wait()
+                    timeout = wait if timeout is None else min(timeout, wait)
+                if timeout is not None:
+                    sock.settimeout(max(timeout, MIN_TIMEOUT))
+                try:
+                    with framer.reserve(blocksize) as view:
+                        received = sock.recv_into(view)
+                except socket.timeout:
+                    continue
+                if not received:
+                    return
+                framer.commit(received)
+                if liveness is not None:
+                    liveness.received()
+                # grow reads while the kernel keeps filling them, shrink when idle
+                if received == blocksize and blocksize < MAX_BLOCKSIZE:
+                    blocksize *= 2
+                elif received < blocksize // 4 and blocksize > MIN_BLOCKSIZE:
+                    blocksize //= 2
+                for received_packet in framer.packets():
+                    if liveness is not None and isinstance(received_packet, packet.HeartbeatPacket):
+                        liveness.received(received_packet)
+                    yield received_packet
+        finally:
+            sock.close()
+    if decode_workers is not None:
+        return tx, PipelinedReceiver(sock, workers=decode_workers)
     return tx, rx()
 
+class Connection:
+    def __init__(self, multiplexer, sock, address, tracker=None, liveness=None):
+        self.multiplexer = multiplexer
+        self.sock = sock
+        self.address = address
+        self.tracker = tracker
+        self.liveness = liveness
+        self.framer = Framer()
+        self.queue = SendQueue()
+        self.outbox = bytearray()
+        self.closed = False
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, pack):
+        self.queue.put(pack)
+        self.multiplexer._wants_write(self)
+
+    def _flush(self):
+        self.outbox += self.queue.take()
+        while self.outbox:
+            try:
+                sent = self.sock.send(self.outbox)
+            except (BlockingIOError, InterruptedError):
+                return
+            del self.outbox[:sent]
+
+    def _receive(self):
+        with self.framer.reserve(MAX_BLOCKSIZE) as view:
+            received = self.sock.recv_into(view)
+        if not received:
+            raise ConnectionResetError('Connection closed by peer')
+        self.framer.commit(received)
+        packets = list(self.framer.packets())
+        if self.liveness is not None:
+            now = self.liveness.clock()
+            self.liveness.received(now=now)
+            for received_packet in packets:
+                if isinstance(received_packet, packet.HeartbeatPacket):
+                    self.liveness.received(received_packet, now)
+        if self.tracker is not None:
+            for received_packet in packets:
+                self.tracker.rx(received_packet)
+        return packets
+
+    def __repr__(self):
+        return '<Connection {0!r}>'.format(self.address)
+
+class Multiplexer:
+    # Watches many server connections from a single thread. Each connection
+    # has its own framer, optional tracker and non-blocking output buffer.
+    def __init__(self, selector=None, connect=socket.create_connection):
+        self.selector = selector if selector is not None else selectors.DefaultSelector()
+        self.connect = connect
+        self.connections = []
+
+    def add(self, host, port=2010, tracker=None, liveness=None):
+        sock = self.connect((host, port))
+        sock.setblocking(False)
+        connection = Connection(self, sock, (host, port), tracker, liveness)
+        self.selector.register(sock, selectors.EVENT_READ, connection)
+        self.connections.append(connection)
+        return connection
+
+    def remove(self, connection):
+        if connection.closed:
+            return
+        connection.closed = True
+        self.selector.unregister(connection.sock)
+        self.connections.remove(connection)
+        connection.sock.close()
+
+    def _wants_write(self, connection):
+        if not connection.closed:
+            self.selector.modify(connection.sock,
+                                 selectors.EVENT_READ | selectors.EVENT_WRITE,
+                                 connection)
+
+    def poll(self, timeout=None):
+        # Returns a list of (connection, packets). A connection that failed
+        # or was closed by the peer is reported once, with closed set.
+        results = []
+        deadlines = [connection.liveness.wait() for connection in self.connections
+                                                if connection.liveness is not None]
+        if deadlines:
+            soonest = min(deadlines)
+            timeout = soonest if timeout is None else min(timeout, soonest)
+        for key, events in self.selector.select(timeout):
+            connection = key.data
+            try:
+                if events & selectors.EVENT_WRITE:
+                    connection._flush()
+                    if not connection.outbox and not connection.queue:
+                        self.selector.modify(connection.sock, selectors.EVENT_READ, connection)
+                if events & selectors.EVENT_READ:
+                    packets = connection._receive()
+                    if packets:
+                        results.append((connection, packets))
+            except (BlockingIOError, InterruptedError):
+                continue
+            except OSError:
+                self.remove(connection)
+                results.append((connection, []))
+        for connection in list(self.connections):
+            if connection.liveness is None:
+                continue
+            try:
+                connection.liveness.check(connection.send)
+            except LinkTimeout:
+                self.remove(connection)
+                results.append((connection, []))
+        return results
+
+    def close(self):
+        for connection in list(self.connections):
+            self.remove(connection)
+        self.selector.close()
+
+class ReconnectingClient:
+    # Wraps connect() so that a dropped link is re-established with jittered
+    # exponential backoff. Registered setup packets (SetShipPacket,
+    # SetConsolePacket, ReadyPacket, ...) are replayed on every connection,
+    # and the tracker's objects are marked stale rather than discarded.
+    def __init__(self, host, port=2010, connect=socket.create_connection,
+                 tracker=None, setup=(), initial_delay=0.5, max_delay=30.0,
+                 factor=2.0, jitter=0.5, sleep=time.sleep, random=random.random,
+                 liveness=None):
+        self.address = (host, port)
+        self.liveness = liveness
+        self.connect = connect
+        self.tracker = tracker
+        self.setup = list(setup)
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.sleep = sleep
+        self.random = random
+        self.attempts = 0
+        self.reconnects = 0
+        self._sock = None
+        self._tx = None
+        self._rx = None
+
+    def register_setup(self, *packs):
+        self.setup.extend(packs)
+
+    def backoff(self):
+        delay = self.initial_delay
+        for _ in range(self.attempts):
+            if delay >= self.max_delay:
+                break
+            delay *= self.factor
+        delay = min(self.max_delay, delay)
+        return delay * (1 - self.jitter * self.random())
+
+    def _connect(self):
+        def open_socket(address):
+            self._sock = self.connect(address)
+            return self._sock
+        host, port = self.address
+        self._tx, self._rx = connect(host, port, connect=open_socket,
+                                     liveness=self.liveness)
+        for pack in self.setup:
+            self._tx(pack)
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._sock.close()
+        self._sock = self._tx = self._rx = None
+        if self.tracker is not None:
+            self.tracker.mark_stale()
+
+    def tx(self, pack):
+        if self._tx is None:
+            raise ConnectionError('Not connected')
+        try:
+            self._tx(pack)
+        except OSError:
+            self._disconnect()
+            raise
+
+    def rx(self):
+        while True:
+            try:
+                if self._rx is None:
+                    self._connect()
+                for received_packet in self._rx:
+                    self.attempts = 0
+                    yield received_packet
+            except OSError:
+                pass
+            self._disconnect()
+            self.sleep(self.backoff())
+            self.attempts += 1
+            self.reconnects += 1
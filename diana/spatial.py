@@ -0,0 +1,61 @@
+import math
+
+DEFAULT_CELL_SIZE = 2500.0
+
+class SpatialGrid:
+    # Uniform grid over the horizontal (x, z) plane. Objects are bucketed by
+    # cell so neighbourhood lookups only visit the cells a circle overlaps.
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.locations = {}
+
+    def _cell(self, x, z):
+        return (int(x // self.cell_size), int(z // self.cell_size))
+
+    def move(self, oid, x, z):
+        cell = self._cell(x, z)
+        old_cell = self.locations.get(oid)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self._discard(oid, old_cell)
+        self.cells.setdefault(cell, set()).add(oid)
+        self.locations[oid] = cell
+
+    def _discard(self, oid, cell):
+        members = self.cells[cell]
+        members.discard(oid)
+        if not members:
+            del self.cells[cell]
+
+    def remove(self, oid):
+        try:
+            cell = self.locations.pop(oid)
+        except KeyError:
+            return
+        self._discard(oid, cell)
+
+    def clear(self):
+        self.cells.clear()
+        self.locations.clear()
+
+    def near(self, x, z, radius):
+        size = self.cell_size
+        x0, x1 = int((x - radius) // size), int((x + radius) // size)
+        z0, z1 = int((z - radius) // size), int((z + radius) // size)
+        cells = self.cells
+        if (x1 - x0 + 1) * (z1 - z0 + 1) > len(cells):
+            for (cx, cz), members in cells.items():
+                if x0 <= cx <= x1 and z0 <= cz <= z1:
+                    yield from members
+            return
+        for cx in range(x0, x1 + 1):
+            for cz in range(z0, z1 + 1):
+                try:
+                    yield from cells[(cx, cz)]
+                except KeyError:
+                    pass
+
+def distance(obj, x, z):
+    return math.hypot(obj.get('x', 0.0) - x, obj.get('z', 0.0) - z)
@@ -0,0 +1,83 @@
+from collections import namedtuple
+import time
+from . import packet as p
+from .ingest import merge_records, BARRIERS
+
+DEFAULT_GAP = 0.005
+DEFAULT_TIMEOUT = 0.1
+
+# packets: everything received in the tick, in order
+# events: the packets other than ObjectUpdates, in order
+# updates: object id -> merged record from this tick's ObjectUpdates
+Tick = namedtuple('Tick', 'start end packets events updates')
+
+class TickBatcher:
+    # Groups the server's per-tick burst of packets into a single Tick. A
+    # tick closes when the gap between packets exceeds `gap`, when it has
+    # been open for `timeout`, or (optionally) on a heartbeat. Completed
+    # ticks are returned and handed to every subscriber.
+    def __init__(self, gap=DEFAULT_GAP, timeout=DEFAULT_TIMEOUT,
+                 heartbeat_boundary=True, clock=time.monotonic):
+        self.gap = gap
+        self.timeout = timeout
+        self.heartbeat_boundary = heartbeat_boundary
+        self.clock = clock
+        self.subscribers = []
+        self._open()
+        self._start = self._last = None
+
+    def _open(self):
+        self._packets = []
+        self._events = []
+        self._updates = {}
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def _close(self):
+        if not self._packets:
+            return []
+        tick = Tick(self._start, self._last, self._packets, self._events, self._updates)
+        self._open()
+        self._start = self._last = None
+        for subscriber in self.subscribers:
+            subscriber(tick)
+        return [tick]
+
+    def poll(self, now=None):
+        if now is None:
+            now = self.clock()
+        if self._packets and (now - self._last > self.gap or
+                              now - self._start >= self.timeout):
+            return self._close()
+        return []
+
+    def push(self, received_packet, now=None):
+        if now is None:
+            now = self.clock()
+        ticks = self.poll(now)
+        if not self._packets:
+            self._start = now
+        self._last = now
+        self._packets.append(received_packet)
+        if isinstance(received_packet, p.ObjectUpdatePacket):
+            merge_records(self._updates, received_packet.records)
+        else:
+            if isinstance(received_packet, p.DestroyObjectPacket):
+                self._updates.pop(received_packet.object, None)
+            elif isinstance(received_packet, BARRIERS):
+                self._updates.clear()
+            self._events.append(received_packet)
+            if self.heartbeat_boundary and isinstance(received_packet, p.HeartbeatPacket):
+                ticks.extend(self._close())
+        return ticks
+
+    def flush(self):
+        return self._close()
+
+    def batches(self, rx):
+        # Wraps a packet iterator (such as connect()'s rx) into one of ticks.
+        # Gaps are only noticed when the next packet arrives.
+        for received_packet in rx:
+            yield from self.push(received_packet)
+        yield from self.flush()
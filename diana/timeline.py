@@ -0,0 +1,127 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+import heapq
+import time
+
+DESTROY = '@destroy'
+RESET = '@reset'
+
+Keyframe = namedtuple('Keyframe', 't seq state')
+
+class Column:
+    # Append-only log of (t, seq, oid, value) for a single field. Float
+    # fields keep their values in a typed array until something else shows up.
+    # by_oid maps each object to the times and row numbers of its own entries,
+    # so one object's history is found without scanning everyone else's.
+    def __init__(self):
+        self.times = array('d')
+        self.seqs = array('Q')
+        self.oids = array('I')
+        self.values = None
+        self.by_oid = {}
+
+    def append(self, t, seq, oid, value):
+        if self.values is None:
+            self.values = array('d') if type(value) is float else []
+        elif type(self.values) is array and type(value) is not float:
+            self.values = list(self.values)
+        try:
+            times, rows = self.by_oid[oid]
+        except KeyError:
+            times, rows = self.by_oid[oid] = (array('d'), array('Q'))
+        times.append(t)
+        rows.append(len(self.times))
+        self.times.append(t)
+        self.seqs.append(seq)
+        self.oids.append(oid)
+        self.values.append(value)
+
+    def entries(self, field, after_seq, until_t):
+        lo = bisect_right(self.seqs, after_seq)
+        hi = bisect_right(self.times, until_t)
+        for index in range(lo, hi):
+            yield self.seqs[index], field, self.oids[index], self.values[index]
+
+class Timeline:
+    def __init__(self, keyframe_interval=30.0, clock=time.monotonic):
+        self.keyframe_interval = keyframe_interval
+        self.clock = clock
+        self.columns = {}
+        self.keyframes = []
+        self.keyframe_times = []
+        self.current = {}
+        self.seq = 0
+        self.last_t = None
+
+    def _advance(self, t):
+        if t is None:
+            t = self.clock()
+        if self.last_t is not None and t < self.last_t:
+            raise ValueError('Timeline entries must be recorded in time order')
+        if not self.keyframes or t >= self.keyframes[-1].t + self.keyframe_interval:
+            state = {oid: dict(obj) for oid, obj in self.current.items()}
+            self.keyframes.append(Keyframe(t, self.seq, state))
+            self.keyframe_times.append(t)
+        self.last_t = t
+        self.seq += 1
+        return t
+
+    def _column(self, field):
+        try:
+            return self.columns[field]
+        except KeyError:
+            column = self.columns[field] = Column()
+            return column
+
+    def record(self, record, t=None):
+        try:
+            oid = record['object']
+        except KeyError:
+            return
+        t = self._advance(t)
+        for field, value in record.items():
+            if field != 'object':
+                self._column(field).append(t, self.seq, oid, value)
+        self.current.setdefault(oid, {}).update(record)
+
+    def destroy(self, oid, t=None):
+        t = self._advance(t)
+        self._column(DESTROY).append(t, self.seq, oid, 0.0)
+        self.current.pop(oid, None)
+
+    def reset(self, t=None):
+        t = self._advance(t)
+        self._column(RESET).append(t, self.seq, 0, 0.0)
+        self.current.clear()
+
+    def state_at(self, t):
+        index = bisect_right(self.keyframe_times, t) - 1
+        if index < 0:
+            return {}
+        keyframe = self.keyframes[index]
+        state = {oid: dict(obj) for oid, obj in keyframe.state.items()}
+        streams = [column.entries(field, keyframe.seq, t)
+                   for field, column in self.columns.items()]
+        for _seq, field, oid, value in heapq.merge(*streams, key=lambda entry: entry[0]):
+            if field == DESTROY:
+                state.pop(oid, None)
+            elif field == RESET:
+                state.clear()
+            else:
+                state.setdefault(oid, {'object': oid})[field] = value
+        return state
+
+    def history(self, oid, field, t0, t1):
+        try:
+            column = self.columns[field]
+        except KeyError:
+            return []
+        try:
+            times, rows = column.by_oid[oid]
+        except KeyError:
+            return []
+        lo = bisect_left(times, t0)
+        hi = bisect_right(times, t1)
+        values = column.values
+        return [(times[index], values[rows[index]]) for index in range(lo, hi)]
@@ -1,8 +1,79 @@
 from . import packet as p
+from . import checkpoint
+from . import metrics
+from .history import Trajectory
+from .spatial import SpatialGrid, DEFAULT_CELL_SIZE, distance
+from collections.abc import Mapping
+from types import MappingProxyType
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+import heapq
+import math
+import threading
+import time
+
+SNAPSHOT_BUCKETS = 256
+
+def _bucket(oid):
+    return hash(oid) % SNAPSHOT_BUCKETS
+
+class Snapshot(Mapping):
+    # Objects are spread over fixed buckets so that successive snapshots can
+    # share every bucket (and every frozen object) that did not change.
+    def __init__(self, version, buckets, length):
+        self.version = version
+        self._buckets = buckets
+        self._length = length
+
+    def __getitem__(self, oid):
+        return self._buckets[_bucket(oid)][oid]
+
+    def __iter__(self):
+        for bucket in self._buckets:
+            yield from bucket
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def player_ship(self):
+        for _obj in self.values():
+            if _obj['type'] == p.ObjectType.player_vessel:
+                return _obj
+        return {}
+
+EMPTY_BUCKETS = (MappingProxyType({}),) * SNAPSHOT_BUCKETS
+
+POSITION_FIELDS = frozenset(('x', 'y', 'z'))
+PLANE_FIELDS = frozenset(('x', 'z'))
+MOTION_FIELDS = frozenset(('x', 'y', 'z', 'heading', 'speed'))
 
 class Tracker:
-    def __init__(self):
+    def __init__(self, clock=time.monotonic, ttl=None, max_objects=None,
+                 cell_size=DEFAULT_CELL_SIZE, history=None, timeline=None):
         self.objects = {}
+        self.by_type = {}
+        self.grid = SpatialGrid(cell_size)
+        self.timestamps = {}
+        self.stale = set()
+        self.last_seen = OrderedDict()
+        self.clock = clock
+        self.ttl = ttl
+        self.max_objects = max_objects
+        self.history_length = history
+        self.timeline = timeline
+        self.watches = []
+        self.proximity_events = []
+        self._moved = set()
+        self.history = {}
+        self._spare_trajectories = []
+        self.version = 0
+        self._velocities = {}
+        self._dirty = set()
+        self._unsaved = set()
+        # ids in the last written checkpoint (full plus incrementals)
+        self._saved = set()
+        self._snapshot = Snapshot(0, EMPTY_BUCKETS, 0)
 
     @property
     def player_ship(self):
@@ -17,20 +88,542 @@ class Tracker:
         except KeyError:
             return
         else:
-            self.objects.setdefault(oid, {}).update(record)
+            now = self.clock()
+            obj = self.objects.setdefault(oid, {})
+            old_type = obj.get('type')
+            obj.update(record)
+            new_type = obj.get('type')
+            if new_type != old_type:
+                if old_type is not None:
+                    del self.by_type[old_type][oid]
+                self.by_type.setdefault(new_type, {})[oid] = obj
+            self._dirty.add(oid)
+            self._unsaved.add(oid)
+            self.stale.discard(oid)
+            self.last_seen[oid] = now
+            self.last_seen.move_to_end(oid)
+            if self.timeline is not None:
+                self.timeline.record(record, now)
+            if not MOTION_FIELDS.isdisjoint(record):
+                self._update_motion(oid, obj, record, now)
+            if self.max_objects is not None:
+                while len(self.objects) > self.max_objects:
+                    self.remove_object(next(iter(self.last_seen)))
+
+    def _update_motion(self, oid, obj, record, now):
+        # _velocities holds (t0, x0, z0, vx, vz): dead reckoning starts from
+        # (x0, z0) at t0, which is the last position fix unless the speed or
+        # heading changed since, in which case it is where the old velocity
+        # had taken the object by then.
+        fixed = not POSITION_FIELDS.isdisjoint(record)
+        if fixed:
+            self.timestamps[oid] = now
+            if not PLANE_FIELDS.isdisjoint(record):
+                self.grid.move(oid, obj.get('x', 0.0), obj.get('z', 0.0))
+                if self.watches:
+                    self._moved.add(oid)
+            if self.history_length is not None:
+                self._record_history(oid, obj, now)
+            x0, z0 = obj.get('x', 0.0), obj.get('z', 0.0)
+        else:
+            x0, _, z0 = self.position_at(oid, now)
+        speed = obj.get('speed', 0.0)
+        if speed:
+            # x and z span the horizontal plane; a heading of 0 points along +z
+            heading = obj.get('heading', 0.0)
+            self._velocities[oid] = (now, x0, z0, speed * math.sin(heading),
+                                     speed * math.cos(heading))
+        elif not fixed and oid in self._velocities:
+            # stopped somewhere short of or past the last position fix
+            self._velocities[oid] = (now, x0, z0, 0.0, 0.0)
+        else:
+            self._velocities.pop(oid, None)
+
+    def _record_history(self, oid, obj, now):
+        try:
+            trajectory = self.history[oid]
+        except KeyError:
+            if self._spare_trajectories:
+                trajectory = self._spare_trajectories.pop()
+            else:
+                trajectory = Trajectory(self.history_length)
+            self.history[oid] = trajectory
+        trajectory.append(now, obj.get('x', 0.0), obj.get('y', 0.0),
+                          obj.get('z', 0.0), obj.get('heading', 0.0))
+
+    def _release_history(self, oid):
+        try:
+            trajectory = self.history.pop(oid)
+        except KeyError:
+            return
+        trajectory.clear()
+        self._spare_trajectories.append(trajectory)
 
     def remove_object(self, oid):
         try:
-            del self.objects[oid]
+            obj = self.objects.pop(oid)
         except KeyError:
             pass
+        else:
+            if 'type' in obj:
+                del self.by_type[obj['type']][oid]
+            # Removals only need recording if a published snapshot or a
+            # checkpoint still holds the object; otherwise forget the id so
+            # churn across long sessions does not accumulate.
+            if oid in self._snapshot:
+                self._dirty.add(oid)
+            else:
+                self._dirty.discard(oid)
+            if oid in self._saved:
+                self._unsaved.add(oid)
+            else:
+                self._unsaved.discard(oid)
+            self.stale.discard(oid)
+            if self.timeline is not None:
+                self.timeline.destroy(oid, self.clock())
+            self.last_seen.pop(oid, None)
+            self.grid.remove(oid)
+            self._moved.discard(oid)
+            for watch in self.watches:
+                self._emit(watch, 'leave', watch.forget(oid))
+            self._release_history(oid)
+            self.timestamps.pop(oid, None)
+            self._velocities.pop(oid, None)
+
+    def mark_stale(self):
+        # Objects stay tracked but are flagged until a fresh update arrives,
+        # e.g. across a reconnect.
+        self.stale.update(self.objects)
+
+    def evict_stale(self, now=None):
+        if self.ttl is None:
+            return
+        if now is None:
+            now = self.clock()
+        deadline = now - self.ttl
+        # last_seen is kept in update order, so stale objects are at the front
+        while self.last_seen:
+            oid, seen = next(iter(self.last_seen.items()))
+            if seen >= deadline:
+                break
+            self.remove_object(oid)
+
+    def reset(self):
+        if self.timeline is not None:
+            self.timeline.reset(self.clock())
+        self._dirty = set(self._snapshot)
+        self._unsaved = set(self._saved)
+        self.objects = {}
+        self.by_type = {}
+        self.stale.clear()
+        self.grid.clear()
+        self._moved.clear()
+        for watch in self.watches:
+            watch.clear()
+        for oid in list(self.history):
+            self._release_history(oid)
+        self.last_seen.clear()
+        self.timestamps.clear()
+        self._velocities.clear()
+
+    def position_at(self, oid, t=None):
+        obj = self.objects[oid]
+        y = obj.get('y', 0.0)
+        try:
+            t0, x0, z0, vx, vz = self._velocities[oid]
+        except KeyError:
+            return obj.get('x', 0.0), y, obj.get('z', 0.0)
+        if t is None:
+            t = self.clock()
+        dt = t - t0
+        return x0 + vx * dt, y, z0 + vz * dt
+
+    def positions_at(self, t=None):
+        if t is None:
+            t = self.clock()
+        objects = self.objects
+        velocities = self._velocities
+        positions = {oid: (objects[oid].get('x', 0.0),
+                           objects[oid].get('y', 0.0),
+                           objects[oid].get('z', 0.0))
+                     for oid in self.timestamps}
+        for oid, (t0, x0, z0, vx, vz) in velocities.items():
+            try:
+                y = positions[oid][1]
+            except KeyError:
+                continue
+            dt = t - t0
+            positions[oid] = (x0 + vx * dt, y, z0 + vz * dt)
+        return positions
+
+    def snapshot(self):
+        if not self._dirty:
+            return self._snapshot
+        buckets = list(self._snapshot._buckets)
+        changed = {}
+        for oid in self._dirty:
+            changed.setdefault(_bucket(oid), []).append(oid)
+        for index, oids in changed.items():
+            bucket = dict(buckets[index])
+            for oid in oids:
+                try:
+                    bucket[oid] = MappingProxyType(dict(self.objects[oid]))
+                except KeyError:
+                    bucket.pop(oid, None)
+            buckets[index] = MappingProxyType(bucket)
+        self._dirty.clear()
+        self.version += 1
+        self._snapshot = Snapshot(self.version, tuple(buckets), len(self.objects))
+        return self._snapshot
+
+    def watch(self, source, target, radius, callback=None):
+        watch = ProximityWatch(source, target, radius, callback)
+        self.watches.append(watch)
+        for oid in self.grid.locations:
+            self._emit(watch, 'enter', watch.update(self, oid)[0])
+        return watch
+
+    def unwatch(self, watch):
+        self.watches.remove(watch)
+
+    def _emit(self, watch, kind, pairs):
+        # Events go to the watch's callback if it has one; only watches
+        # without a callback queue them for drain_proximity_events.
+        for source, target in pairs:
+            event = ProximityEvent(kind, watch, source, target)
+            if watch.callback is None:
+                self.proximity_events.append(event)
+            else:
+                watch.callback(event)
+
+    def check_proximity(self):
+        moved, self._moved = self._moved, set()
+        for oid in moved:
+            for watch in self.watches:
+                entered, left = watch.update(self, oid)
+                self._emit(watch, 'leave', left)
+                self._emit(watch, 'enter', entered)
+
+    def drain_proximity_events(self):
+        events, self.proximity_events = self.proximity_events, []
+        return events
+
+    def query(self, type=None, where=None, near=None, order_by=None, limit=None):
+        return Query(type, where, near, order_by, limit)(self)
+
+    def save(self, path, incremental=False):
+        if incremental:
+            changed = {oid: self.objects[oid] for oid in self._unsaved
+                                              if oid in self.objects}
+            removed = [oid for oid in self._unsaved if oid not in self.objects]
+            checkpoint.save(path, changed, removed, incremental=True)
+            self._saved.update(changed)
+            self._saved.difference_update(removed)
+        else:
+            checkpoint.save(path, self.objects)
+            self._saved = set(self.objects)
+        self._unsaved.clear()
+
+    def load(self, path):
+        objects = checkpoint.load(path)
+        self.reset()
+        for record in objects.values():
+            self.update_object(record)
+        self._unsaved.clear()
+        self._saved = set(self.objects)
+
+    def update_records(self, records):
+        registry = metrics.registry
+        if registry is not None:
+            records = list(records)
+            start = registry.clock()
+        for record in records:
+            self.update_object(record)
+        self.evict_stale()
+        if self._moved:
+            self.check_proximity()
+        if registry is not None:
+            registry.observe('tracker_update_seconds', None, registry.clock() - start)
+            registry.inc('tracker_records_total', None, len(records))
+            registry.set('tracker_objects', None, len(self.objects))
+
+    def rx_tick(self, tick):
+        for event in tick.events:
+            self.rx(event)
+        if tick.updates:
+            self.update_records(tick.updates.values())
 
     def rx(self, packet):
         if isinstance(packet, p.ObjectUpdatePacket):
-            for record in packet.records:
-                self.update_object(record)
+            self.update_records(packet.records)
         elif isinstance(packet, p.DestroyObjectPacket):
             self.remove_object(packet.object)
         elif isinstance(packet, p.IntelPacket):
             self.update_object({'object': packet.object, 'intel': packet.intel})
+        elif isinstance(packet, (p.GameStartPacket, p.GameEndPacket)):
+            self.reset()
+
+
+ProximityEvent = namedtuple('ProximityEvent', 'kind watch source target')
+
+def _matcher(spec):
+    if isinstance(spec, p.ObjectType):
+        return lambda oid, obj: obj.get('type') == spec
+    return lambda oid, obj: oid == spec
+
+class ProximityWatch:
+    # Tracks which (source, target) pairs are within radius of each other.
+    # Sources and targets are given as an ObjectType or a single object id.
+    # Only objects that moved are re-evaluated, against grid neighbours.
+    def __init__(self, source, target, radius, callback=None):
+        self.source = source
+        self.target = target
+        self.radius = radius
+        self.callback = callback
+        self.is_source = _matcher(source)
+        self.is_target = _matcher(target)
+        self.pairs = set()
+        self.by_object = {}
+
+    def clear(self):
+        self.pairs.clear()
+        self.by_object.clear()
+
+    def _add(self, pair):
+        self.pairs.add(pair)
+        for oid in pair:
+            self.by_object.setdefault(oid, set()).add(pair)
+
+    def _remove(self, pair):
+        self.pairs.discard(pair)
+        for oid in pair:
+            members = self.by_object.get(oid)
+            if members is not None:
+                members.discard(pair)
+                if not members:
+                    del self.by_object[oid]
+
+    def forget(self, oid):
+        pairs = list(self.by_object.get(oid, ()))
+        for pair in pairs:
+            self._remove(pair)
+        return pairs
+
+    def update(self, tracker, oid):
+        objects = tracker.objects
+        obj = objects[oid]
+        as_source = self.is_source(oid, obj)
+        as_target = self.is_target(oid, obj)
+        current = set()
+        if as_source or as_target:
+            x, z = obj.get('x', 0.0), obj.get('z', 0.0)
+            for other in tracker.grid.near(x, z, self.radius):
+                if other == oid:
+                    continue
+                other_obj = objects[other]
+                if distance(other_obj, x, z) > self.radius:
+                    continue
+                if as_source and self.is_target(other, other_obj):
+                    current.add((oid, other))
+                if as_target and self.is_source(other, other_obj):
+                    current.add((other, oid))
+        previous = self.by_object.get(oid, set())
+        entered = current - previous
+        left = previous - current
+        for pair in left:
+            self._remove(pair)
+        for pair in entered:
+            self._add(pair)
+        return entered, left
+
+def _field_test(field, expected):
+    if callable(expected):
+        def test(obj):
+            try:
+                return expected(obj[field])
+            except KeyError:
+                return False
+    else:
+        def test(obj):
+            return obj.get(field, test) == expected
+    return test
+
+def _compile_where(where):
+    if where is None:
+        return None
+    if callable(where):
+        return where
+    tests = tuple(_field_test(field, expected) for field, expected in where.items())
+    if len(tests) == 1:
+        return tests[0]
+    return lambda obj: all(test(obj) for test in tests)
+
+def _compile_order(order_by):
+    if order_by is None or callable(order_by):
+        return order_by, False
+    reverse = order_by.startswith('-')
+    field = order_by.lstrip('-')
+    return (lambda obj: obj.get(field, 0)), reverse
+
+class Query:
+    # A query is compiled once and can be run against a tracker every tick.
+    #   type:     an ObjectType or an iterable of them
+    #   where:    a predicate, or a dict of field -> value or field -> predicate
+    #   near:     (x, z, radius) in the horizontal plane
+    #   order_by: a key function or a field name, prefixed with '-' to reverse
+    #   limit:    keep only the first n results
+    def __init__(self, type=None, where=None, near=None, order_by=None, limit=None):
+        if isinstance(type, p.ObjectType):
+            type = (type,)
+        self.types = None if type is None else tuple(type)
+        self.predicate = _compile_where(where)
+        self.near = near
+        self.key, self.reverse = _compile_order(order_by)
+        self.limit = limit
+
+    def candidates(self, tracker):
+        if self.near is not None:
+            x, z, radius = self.near
+            objects = tracker.objects
+            for oid in tracker.grid.near(x, z, radius):
+                obj = objects[oid]
+                if distance(obj, x, z) > radius:
+                    continue
+                if self.types is not None and obj.get('type') not in self.types:
+                    continue
+                yield obj
+        elif self.types is not None:
+            for otype in self.types:
+                yield from tracker.by_type.get(otype, {}).values()
+        else:
+            yield from tracker.objects.values()
+
+    def __call__(self, tracker):
+        results = self.candidates(tracker)
+        if self.predicate is not None:
+            results = filter(self.predicate, results)
+        if self.key is None:
+            results = list(results)
+            return results if self.limit is None else results[:self.limit]
+        if self.limit is not None:
+            select = heapq.nlargest if self.reverse else heapq.nsmallest
+            return select(self.limit, results, key=self.key)
+        return sorted(results, key=self.key, reverse=self.reverse)
+
+class ConcurrentTracker(Tracker):
+    # A single writer applies packets in batches and publishes an immutable
+    # snapshot as `state` once per batch; readers use `state` without locking.
+    # With type_locks, the writer also holds a lock per object type while it
+    # mutates objects of that type, so readers may take `read_lock(type)` to
+    # walk the live `by_type[type]` index.
+    #
+    # Every public entry point that mutates state, update_object included,
+    # runs inside `_writing`. Nested entry points (rx -> update_records) share
+    # the outer critical section and `state` is published once, when the
+    # outermost one exits.
+    def __init__(self, *args, type_locks=False, **kwargs):
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        if type_locks:
+            self._type_locks = {otype: threading.RLock() for otype in p.ObjectType}
+        else:
+            self._type_locks = None
+        super().__init__(*args, **kwargs)
+        self.state = self.snapshot()
+
+    def read_lock(self, object_type):
+        if self._type_locks is None:
+            raise ValueError('Tracker was created without type_locks')
+        return self._type_locks[object_type]
+
+    @contextmanager
+    def _writing(self, types=None):
+        # types=None means every type may change; nested calls run under the
+        # locks their outermost caller already holds
+        with self._write_lock:
+            locks = []
+            if self._type_locks is not None and self._write_depth == 0:
+                if types is None or self.ttl is not None or self.max_objects is not None:
+                    types = list(p.ObjectType)
+                else:
+                    types = sorted(types - {None}, key=lambda otype: otype.value)
+                locks = [self._type_locks[otype] for otype in types]
+            for lock in locks:
+                lock.acquire()
+            self._write_depth += 1
+            try:
+                yield
+            finally:
+                self._write_depth -= 1
+                for lock in reversed(locks):
+                    lock.release()
+                if self._write_depth == 0:
+                    self.state = self.snapshot()
+
+    def _type_of(self, oid):
+        return self.objects.get(oid, {}).get('type')
+
+    def _record_types(self, records, types):
+        for record in records:
+            types.add(record.get('type'))
+            types.add(self._type_of(record.get('object')))
+
+    def _touched_types(self, packets):
+        types = set()
+        for packet in packets:
+            if isinstance(packet, p.ObjectUpdatePacket):
+                self._record_types(packet.records, types)
+            elif isinstance(packet, (p.DestroyObjectPacket, p.IntelPacket)):
+                types.add(self._type_of(packet.object))
+            elif isinstance(packet, (p.GameStartPacket, p.GameEndPacket)):
+                return None
+        return types
+
+    def rx_batch(self, packets):
+        packets = list(packets)
+        with self._writing(self._touched_types(packets)):
+            for packet in packets:
+                super().rx(packet)
+        return self.state
+
+    def rx(self, packet):
+        return self.rx_batch((packet,))
+
+    def rx_tick(self, tick):
+        types = self._touched_types(tick.events)
+        if types is not None:
+            self._record_types(tick.updates.values(), types)
+        with self._writing(types):
+            super().rx_tick(tick)
+        return self.state
+
+    def update_records(self, records):
+        records = list(records)
+        types = set()
+        self._record_types(records, types)
+        with self._writing(types):
+            super().update_records(records)
+
+    def update_object(self, record):
+        with self._writing({record.get('type'), self._type_of(record.get('object'))}):
+            super().update_object(record)
+
+    def remove_object(self, oid):
+        with self._writing({self._type_of(oid)}):
+            super().remove_object(oid)
+
+    def mark_stale(self):
+        with self._writing():
+            super().mark_stale()
+
+    def evict_stale(self, now=None):
+        with self._writing():
+            super().evict_stale(now)
+
+    def reset(self):
+        with self._writing():
+            super().reset()
 
+    def load(self, path):
+        with self._writing():
+            super().load(path)
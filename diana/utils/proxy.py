@@ -1,55 +1,169 @@
-from diana import packet
+from diana import metrics, packet
+from diana.fanout import FanOut, DROP, RESYNC, DEFAULT_MAXLEN
+from diana.framing import Framer, HEADER, HEADER_SIZE
+from diana.log import PacketLog
+from diana.rules import RuleSet
 import argparse
 import asyncio
-import sys
-import socket
-from functools import partial
+import importlib
 
-class Buffer:
-    def __init__(self, provenance):
-        self.buffer = b''
-        self.provenance = provenance
+BLOCKSIZE = 65536
 
-    def eat(self, data):
-        self.buffer += data
-        packets, self.buffer = packet.decode(self.buffer, provenance=self.provenance)
-        return packets
+PASSTHROUGH = 'passthrough'
+REENCODE = 'reencode'
 
-BLOCKSIZE = 1024
+async def transit(reader, writer, provenance, tag, mode=PASSTHROUGH, log=None,
+                  rules=None):
+    # In passthrough mode each frame is relayed byte-for-byte as soon as its
+    # boundary is known. log(tag, ptype, frame) should only queue the frame;
+    # PacketLog.log_frame decodes and formats it on its own thread. A RuleSet
+    # may drop, rewrite or add frames; packet types without rules are not
+    # decoded by it.
+    framer = Framer(provenance)
+    while True:
+        data = await reader.read(BLOCKSIZE)
+        if not data:
+            writer.close()
+            return
+        framer.feed(data)
+        for ptype, frame in framer.frames():
+            if log is not None:
+                log(tag, ptype, frame)
+            frames = [frame] if rules is None else rules.apply(ptype, frame)
+            if metrics.registry is not None:
+                metrics.registry.inc('proxy_forwarded_total', packet.packet_name(ptype), len(frames))
+            for frame in frames:
+                if mode == PASSTHROUGH:
+                    writer.write(frame)
+                else:
+                    pkt = packet.decode_payload(HEADER.unpack_from(frame)[5], frame[HEADER_SIZE:])
+                    writer.write(packet.encode(pkt, provenance=provenance))
+        await writer.drain()
 
-if __name__ == '__main__':
+async def broadcast(hub, reader, tag='[S>*]', log=None):
+    # Single upstream session; every server frame is published to the hub.
+    framer = Framer(hub.provenance)
+    while True:
+        data = await reader.read(BLOCKSIZE)
+        if not data:
+            hub.close()
+            return
+        framer.feed(data)
+        for ptype, frame in framer.frames():
+            hub.publish(ptype, frame)
+            if metrics.registry is not None:
+                metrics.registry.set('proxy_spectators', None, len(hub.subscribers))
+            if log is not None:
+                log(tag, ptype, frame)
+
+async def spectate(hub, reader, writer):
+    wake = asyncio.Event()
+    subscriber = hub.subscribe(wakeup=wake.set)
+
+    async def discard():
+        # spectators only watch; whatever they send is read and dropped
+        while await reader.read(BLOCKSIZE):
+            pass
+        subscriber.closed = True
+        wake.set()
+
+    reading = asyncio.ensure_future(discard())
+    try:
+        while True:
+            frames = subscriber.take()
+            if frames:
+                writer.writelines(frames)
+                await writer.drain()
+            if subscriber.closed:
+                break
+            await wake.wait()
+            wake.clear()
+    except ConnectionError:
+        pass
+    finally:
+        hub.unsubscribe(subscriber)
+        reading.cancel()
+        writer.close()
+
+def main():
     parser = argparse.ArgumentParser(description='Simple Artemis SBS proxy')
     parser.add_argument('proxy_port', type=int, help='Server port')
     parser.add_argument('address', help='Server address (DNS, IPv4 or IPv6)')
     parser.add_argument('port', type=int, nargs='?', default=2010, help='Server port')
+    parser.add_argument('--mode', choices=(PASSTHROUGH, REENCODE), default=PASSTHROUGH,
+                        help='Relay frames verbatim, or decode and re-encode them')
+    parser.add_argument('--quiet', action='store_true',
+                        help='Do not decode or log forwarded packets')
+    parser.add_argument('--truncate', type=int, default=None,
+                        help='Truncate logged packets to this many characters')
+    parser.add_argument('--sample-updates', type=int, default=1,
+                        help='Log only one in N object updates')
+    parser.add_argument('--rules', default=None,
+                        help='Module whose RULES list filters and rewrites forwarded packets')
+    parser.add_argument('--metrics', default=None,
+                        help='Write Prometheus-format metrics to this file periodically')
+    parser.add_argument('--metrics-interval', type=float, default=10.0,
+                        help='Seconds between metrics writes')
+    parser.add_argument('--fanout', action='store_true',
+                        help='Share one server connection between all clients as spectators')
+    parser.add_argument('--queue', type=int, default=DEFAULT_MAXLEN,
+                        help='Frames queued per spectator before the slow-client policy applies')
+    parser.add_argument('--slow', choices=(RESYNC, DROP), default=RESYNC,
+                        help='Resync slow spectators from the world state, or drop their frames')
     args = parser.parse_args()
 
     loop = asyncio.get_event_loop()
+    if args.quiet:
+        log = None
+    else:
+        log = PacketLog(truncate=args.truncate,
+                        sample={packet.ObjectUpdatePacket: args.sample_updates}).log_frame
 
-    @asyncio.coroutine
-    def transit(reader, writer, provenance, tag):
-        buf = Buffer(provenance)
-        while True:
-            data = yield from reader.read(BLOCKSIZE)
-            for pkt in buf.eat(data):
-                writer.write(packet.encode(pkt, provenance=provenance))
-                sys.stdout.write('{} {}\n'.format(tag, pkt))
-                sys.stdout.flush()
-
-    @asyncio.coroutine
-    def handle_p2c(client_reader, client_writer):
-        server_reader, server_writer = yield from asyncio.open_connection(args.address,
-                                                                          args.port,
-                                                                          loop=loop)
-        asyncio.async(transit(client_reader, server_writer,
-                              provenance=packet.PacketProvenance.client,
-                              tag='[C>S]'), loop=loop)
-        asyncio.async(transit(server_reader, client_writer,
-                              provenance=packet.PacketProvenance.server,
-                              tag='[C<S]'), loop=loop)
-
-    svr = asyncio.start_server(handle_p2c, '127.0.0.1', args.proxy_port, loop=loop)
+    if args.metrics is not None:
+        registry = metrics.enable()
+
+        def write_metrics():
+            with open(args.metrics, 'w') as f:
+                f.write(registry.prometheus())
+            loop.call_later(args.metrics_interval, write_metrics)
+
+        loop.call_soon(write_metrics)
+
+    rules = None
+    if args.rules is not None:
+        rules = importlib.import_module(args.rules).RULES
+
+    def ruleset(provenance):
+        return None if rules is None else RuleSet(rules, provenance)
+
+    if args.fanout:
+        hub = FanOut(maxlen=args.queue, policy=args.slow)
+        server_reader, server_writer = loop.run_until_complete(
+                asyncio.open_connection(args.address, args.port))
+        upstream = asyncio.ensure_future(broadcast(hub, server_reader, log=log))
+        upstream.add_done_callback(lambda _: loop.stop())
+        svr = asyncio.start_server(lambda r, w: spectate(hub, r, w),
+                                   '127.0.0.1', args.proxy_port)
+        loop.run_until_complete(svr)
+        loop.run_forever()
+        return
+
+    async def handle_p2c(client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection(args.address,
+                                                                     args.port)
+        asyncio.ensure_future(transit(client_reader, server_writer,
+                                      provenance=packet.PacketProvenance.client,
+                                      tag='[C>S]', mode=args.mode, log=log,
+                                      rules=ruleset(packet.PacketProvenance.client)))
+        asyncio.ensure_future(transit(server_reader, client_writer,
+                                      provenance=packet.PacketProvenance.server,
+                                      tag='[C<S]', mode=args.mode, log=log,
+                                      rules=ruleset(packet.PacketProvenance.server)))
+
+    svr = asyncio.start_server(handle_p2c, '127.0.0.1', args.proxy_port)
     server = loop.run_until_complete(svr)
 
     loop.run_forever()
 
+if __name__ == '__main__':
+    main()
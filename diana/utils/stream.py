@@ -1,15 +1,24 @@
 from diana import connect
+from diana.log import PacketLog
+from diana.packet import ObjectUpdatePacket
 import argparse
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Simple Artemis SBS stream')
     parser.add_argument('address', help='Server address (DNS, IPv4 or IPv6)')
     parser.add_argument('port', type=int, nargs='?', default=2010, help='Server port')
+    parser.add_argument('--truncate', type=int, default=None,
+                        help='Truncate logged packets to this many characters')
+    parser.add_argument('--sample-updates', type=int, default=1,
+                        help='Log only one in N object updates')
     args = parser.parse_args()
+    log = PacketLog(truncate=args.truncate,
+                    sample={ObjectUpdatePacket: args.sample_updates})
     tx, rx = connect(args.address, args.port)
     try:
         for packet in rx:
-            print(packet)
+            log.log(None, packet)
     except KeyboardInterrupt:
         pass
-
+    finally:
+        log.close()
@@ -0,0 +1,72 @@
+import asyncio
+import diana.aio as aio
+import diana.packet as p
+from diana.liveness import Liveness, LinkTimeout
+from nose.tools import *
+
+WELCOME = b'\xef\xbe\xad\xde+\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x17\x00\x00\x00\xda\xb3\x04m\x0f\x00\x00\x00Welcome to eyes'
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+def test_async_iteration_and_send():
+    received = []
+    async def scenario():
+        async def handle(reader, writer):
+            writer.write(WELCOME[:7])
+            await writer.drain()
+            writer.write(WELCOME[7:] + WELCOME)
+            received.append(await reader.readexactly(2 * 32))
+            writer.close()
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        client = await aio.connect('127.0.0.1', port)
+        await client.send(p.SetShipPacket(1))
+        await client.send_many([p.ReadyPacket()])
+        packets = []
+        async for packet in client:
+            packets.append(packet)
+        client.close()
+        server.close()
+        await server.wait_closed()
+        return packets
+    packets = run(scenario())
+    eq_([packet.message for packet in packets], ['Welcome to eyes'] * 2)
+    eq_(received, [p.encode(p.SetShipPacket(1)) + p.encode(p.ReadyPacket())])
+
+def test_protocol_pauses_reading_when_backlogged():
+    class Transport:
+        paused = False
+        def pause_reading(self):
+            self.paused = True
+        def resume_reading(self):
+            self.paused = False
+    protocol = aio.ArtemisProtocol(max_pending=2)
+    transport = Transport()
+    protocol.connection_made(transport)
+    protocol.data_received(WELCOME * 3)
+    assert transport.paused
+    run(protocol.get())
+    run(protocol.get())
+    assert not transport.paused
+
+def test_liveness_closes_silent_link():
+    heard = []
+    async def scenario():
+        async def handle(reader, writer):
+            heard.append(await reader.read(1024))
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        client = await aio.connect('127.0.0.1', port,
+                                   liveness=Liveness(interval=0.01, timeout=0.1))
+        try:
+            with assert_raises(LinkTimeout):
+                await client.recv()
+        finally:
+            server.close()
+    run(scenario())
+    assert heard[0].startswith(p.encode(p.HeartbeatPacket()))
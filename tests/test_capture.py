@@ -0,0 +1,34 @@
+import diana.packet as p
+from diana.capture import index_frames, decode_capture
+import os
+import struct
+import tempfile
+from nose.tools import *
+
+def server_frame(pack):
+    return p.encode(pack, provenance=p.PacketProvenance.server)
+
+def test_index_frames():
+    frame = server_frame(p.WelcomePacket('hi'))
+    data = frame + b'junk' + frame + frame[:10]
+    offsets, lengths = index_frames(data)
+    eq_(list(offsets), [0, len(frame) + 4])
+    eq_(list(lengths), [len(frame)] * 2)
+
+def test_index_frames_filters_provenance():
+    data = server_frame(p.WelcomePacket('hi')) + p.encode(p.ReadyPacket())
+    offsets, lengths = index_frames(data, provenance=p.PacketProvenance.client)
+    eq_(len(offsets), 1)
+
+def test_decode_capture_in_order():
+    frames = [server_frame(p.WelcomePacket('message {}'.format(n))) for n in range(50)]
+    frames.append(server_frame(p.ObjectUpdatePacket(struct.pack('<BIBfff', 0x06, 7, 0x07, 1.0, 2.0, 3.0))))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'capture.bin')
+        with open(path, 'wb') as f:
+            f.write(b''.join(frames))
+        results = list(decode_capture(path, workers=2, chunk_frames=8, window=2))
+    eq_(len(results), 51)
+    eq_(results[3][1].message, 'message 3')
+    eq_(results[3][0], sum(len(frame) for frame in frames[:3]))
+    eq_(results[-1][1].records[0]['object'], 7)
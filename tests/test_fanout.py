@@ -0,0 +1,81 @@
+import diana.packet as p
+from diana.fanout import FanOut, DROP, RESYNC, encode_world
+from diana.framing import Framer
+from diana.object_update import encode_obj_update_packet
+from nose.tools import *
+
+SERVER = p.PacketProvenance.server
+
+def frame(pkt):
+    return pkt.packet_id, p.encode(pkt, provenance=SERVER)
+
+def update(*records):
+    return frame(p.ObjectUpdatePacket(encode_obj_update_packet(records)))
+
+def mine(oid, x):
+    return {'object': oid, 'type': p.ObjectType.mine, 'x': x}
+
+def received(frames):
+    framer = Framer(SERVER)
+    framer.feed(b''.join(frames))
+    return list(framer.packets())
+
+def test_frames_are_shared():
+    hub = FanOut()
+    a, b = hub.subscribe(), hub.subscribe()
+    ptype, data = update(mine(1, 2.0))
+    hub.publish(ptype, data)
+    assert a.take()[-1] is b.take()[-1] is data
+
+def test_late_joiner_bootstrap():
+    hub = FanOut()
+    hub.publish(*frame(p.GameStartPacket()))
+    hub.publish(*update(mine(1, 2.0), mine(2, 3.0)))
+    hub.publish(*frame(p.DestroyObjectPacket(p.ObjectType.mine, 1)))
+    hub.publish(*frame(p.HeartbeatPacket()))
+    packets = received(hub.subscribe().take())
+    assert isinstance(packets[0], p.GameStartPacket)
+    eq_([record for pkt in packets[1:] for record in pkt.records], [mine(2, 3.0)])
+
+def test_game_end_clears_session():
+    hub = FanOut()
+    hub.publish(*frame(p.GameStartPacket()))
+    hub.publish(*frame(p.GameEndPacket()))
+    eq_(hub.subscribe().take(), [])
+
+def test_slow_client_drop():
+    hub = FanOut(maxlen=2, policy=DROP)
+    sub = hub.subscribe()
+    for x in range(4):
+        hub.publish(*update(mine(1, float(x))))
+    eq_(len(sub), 2)
+    eq_(sub.dropped, 2)
+
+def test_slow_client_resync():
+    hub = FanOut(maxlen=2, policy=RESYNC)
+    sub = hub.subscribe()
+    for x in range(4):
+        hub.publish(*update(mine(x, 1.0)))
+    eq_(sub.resyncs, 1)
+    records = [record for pkt in received(sub.take()) for record in pkt.records]
+    eq_(sorted(record['object'] for record in records), [0, 1, 2, 3])
+
+def test_close_and_wakeup():
+    woken = []
+    hub = FanOut()
+    sub = hub.subscribe(wakeup=lambda: woken.append(True))
+    hub.close()
+    assert sub.closed
+    eq_(len(woken), 2)
+
+def test_subscribe_after_close():
+    hub = FanOut()
+    hub.close()
+    sub = hub.subscribe()
+    assert sub.closed
+    eq_(hub.subscribers, [])
+
+def test_encode_world_splits_payloads():
+    frames = encode_world([mine(oid, 1.0) for oid in range(100)], max_payload=100)
+    assert len(frames) > 1
+    eq_(len([record for pkt in received(frames) for record in pkt.records]), 100)
@@ -0,0 +1,42 @@
+import diana.packet as p
+from diana.framing import Framer
+from nose.tools import *
+
+WELCOME = b'\xef\xbe\xad\xde+\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x17\x00\x00\x00\xda\xb3\x04m\x0f\x00\x00\x00Welcome to eyes'
+
+def test_frame_byte_at_a_time():
+    framer = Framer(size=16)
+    packets = []
+    for byte in WELCOME * 2:
+        framer.feed(bytes((byte,)))
+        packets.extend(framer.packets())
+    eq_(len(packets), 2)
+    assert isinstance(packets[0], p.WelcomePacket)
+    eq_(len(framer), 0)
+
+def test_frame_raw_bytes():
+    framer = Framer()
+    framer.feed(WELCOME + WELCOME[:5])
+    frames = list(framer.frames())
+    eq_(frames, [(p.WelcomePacket.packet_id, WELCOME)])
+    eq_(len(framer), 5)
+
+def test_frame_resync():
+    framer = Framer()
+    framer.feed(b'\x00\x01garbage' + WELCOME)
+    packets = list(framer.packets())
+    eq_(len(packets), 1)
+    eq_(framer.resyncs, 1)
+
+def test_frame_rejects_wrong_origin():
+    framer = Framer(provenance=p.PacketProvenance.client)
+    framer.feed(WELCOME)
+    eq_(list(framer.frames()), [])
+    assert framer.resyncs > 0
+
+def test_reserve_commit():
+    framer = Framer(size=8)
+    with framer.reserve(len(WELCOME)) as view:
+        view[:] = WELCOME
+    framer.commit(len(WELCOME))
+    eq_(len(list(framer.packets())), 1)
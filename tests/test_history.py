@@ -0,0 +1,31 @@
+from diana.history import Trajectory
+from nose.tools import *
+
+def test_trajectory_fills_in_order():
+    trajectory = Trajectory(4)
+    for n in range(3):
+        trajectory.append(float(n), n * 10.0, 0.0, 0.0, 0.0)
+    eq_(len(trajectory), 3)
+    eq_(list(trajectory.column('x')), [0.0, 10.0, 20.0])
+
+def test_trajectory_wraps():
+    trajectory = Trajectory(3)
+    for n in range(5):
+        trajectory.append(float(n), n * 10.0, 0.0, 0.0, 0.0)
+    eq_(len(trajectory), 3)
+    eq_(list(trajectory.column('t')), [2.0, 3.0, 4.0])
+    eq_(trajectory.latest(), (4.0, 40.0, 0.0, 0.0, 0.0))
+    eq_(trajectory.samples()[0], (2.0, 20.0, 0.0, 0.0, 0.0))
+
+def test_trajectory_velocity():
+    trajectory = Trajectory(8)
+    trajectory.append(0.0, 0.0, 0.0, 0.0, 0.0)
+    trajectory.append(2.0, 4.0, 0.0, -2.0, 0.0)
+    eq_(trajectory.velocity(), (2.0, 0.0, -1.0))
+
+def test_trajectory_storage_is_preallocated():
+    trajectory = Trajectory(16)
+    before = {field: column.buffer_info() for field, column in trajectory.columns.items()}
+    for n in range(100):
+        trajectory.append(float(n), 0.0, 0.0, 0.0, 0.0)
+    eq_({field: column.buffer_info() for field, column in trajectory.columns.items()}, before)
@@ -0,0 +1,68 @@
+import diana.packet as p
+from diana.ingest import IngestBuffer
+from diana.tracking import Tracker
+import struct
+from nose.tools import *
+
+def mine_update(oid, x):
+    return p.ObjectUpdatePacket(struct.pack('<BIBf', 0x06, oid, 0x01, x))
+
+def test_updates_merge_per_object():
+    buffer = IngestBuffer()
+    for n in range(10):
+        buffer.put(mine_update(1, float(n)))
+    buffer.put(mine_update(2, 5.0))
+    events, records = buffer.take()
+    eq_(events, [])
+    eq_(sorted((record['object'], record['x']) for record in records), [(1, 9.0), (2, 5.0)])
+    eq_(buffer.merged, 9)
+    eq_(len(buffer), 0)
+
+def test_destroy_discards_pending_update():
+    buffer = IngestBuffer()
+    buffer.put(mine_update(1, 1.0))
+    destroy = p.DestroyObjectPacket(type=p.ObjectType.mine, object=1)
+    buffer.put(destroy)
+    buffer.put(mine_update(2, 1.0))
+    events, records = buffer.take()
+    eq_(events, [destroy])
+    eq_([record['object'] for record in records], [2])
+
+def test_game_start_discards_all_pending_updates():
+    buffer = IngestBuffer()
+    buffer.put(mine_update(1, 1.0))
+    start = p.GameStartPacket()
+    buffer.put(start)
+    events, records = buffer.take()
+    eq_(events, [start])
+    eq_(records, [])
+
+def test_event_queue_is_bounded():
+    buffer = IngestBuffer(max_events=2)
+    for n in range(5):
+        buffer.put(p.IntelPacket(object=n, intel='x'))
+    events, records = buffer.take()
+    eq_([event.object for event in events], [3, 4])
+    eq_(buffer.dropped, 3)
+
+def test_full_queue_keeps_destroys_and_barriers():
+    buffer = IngestBuffer(max_events=2)
+    buffer.put(p.DestroyObjectPacket(type=p.ObjectType.mine, object=1))
+    buffer.put(p.HeartbeatPacket())
+    buffer.put(p.HeartbeatPacket())
+    buffer.put(p.IntelPacket(object=2, intel='x'))
+    buffer.put(p.GameEndPacket())
+    events, records = buffer.take()
+    eq_([type(event) for event in events],
+        [p.DestroyObjectPacket, p.GameEndPacket])
+    eq_(buffer.dropped, 3)
+
+def test_drain_into_tracker():
+    buffer = IngestBuffer()
+    tracker = Tracker()
+    buffer.put(mine_update(1, 1.0))
+    buffer.put(mine_update(1, 2.0))
+    buffer.put(p.IntelPacket(object=1, intel='mine'))
+    buffer.drain_into(tracker)
+    eq_(tracker.objects[1]['x'], 2.0)
+    eq_(tracker.objects[1]['intel'], 'mine')
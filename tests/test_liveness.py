@@ -0,0 +1,83 @@
+import diana.packet as p
+import diana.socket as s
+from diana.liveness import Liveness, LinkTimeout
+import socket
+from nose.tools import *
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_heartbeat_due_and_wait():
+    clock = FakeClock()
+    liveness = Liveness(interval=3.0, timeout=10.0, clock=clock)
+    assert not liveness.heartbeat_due()
+    eq_(liveness.wait(), 3.0)
+    clock.now = 3.0
+    sent = []
+    liveness.check(sent.append)
+    eq_(len(sent), 1)
+    assert isinstance(sent[0], p.HeartbeatPacket)
+    eq_(liveness.wait(), 3.0)
+
+def test_rtt_and_staleness():
+    clock = FakeClock()
+    liveness = Liveness(clock=clock)
+    clock.now = 3.0
+    liveness.check(lambda heartbeat: None)
+    clock.now = 3.25
+    liveness.received(p.HeartbeatPacket())
+    clock.now = 4.0
+    eq_(liveness.metrics(), {'rtt': 0.25, 'staleness': 0.75, 'heartbeats_sent': 1})
+
+def test_expiry():
+    clock = FakeClock()
+    liveness = Liveness(interval=3.0, timeout=10.0, clock=clock)
+    clock.now = 10.5
+    with assert_raises(LinkTimeout):
+        liveness.check(lambda heartbeat: None)
+
+def test_blocking_client_heartbeats_and_times_out():
+    clock = FakeClock()
+    sent = []
+    def mock_connect(address):
+        class MockFD:
+            def settimeout(self, timeout):
+                pass
+            def sendall(self, data):
+                sent.append(data)
+            def recv_into(self, buffer):
+                clock.now += 4.0
+                raise socket.timeout()
+            def close(self):
+                pass
+        return MockFD()
+    liveness = Liveness(interval=3.0, timeout=10.0, clock=clock)
+    tx, rx = s.connect('artemis', connect=mock_connect, liveness=liveness)
+    with assert_raises(LinkTimeout):
+        next(rx)
+    eq_(sent, [p.encode(p.HeartbeatPacket())] * 2)
+
+def test_blocking_client_never_sets_zero_timeout():
+    clock = FakeClock()
+    timeouts = []
+    def mock_connect(address):
+        class MockFD:
+            def settimeout(self, timeout):
+                timeouts.append(timeout)
+            def sendall(self, data):
+                pass
+            def recv_into(self, buffer):
+                clock.now += 3.0
+                raise socket.timeout()
+            def close(self):
+                pass
+        return MockFD()
+    liveness = Liveness(interval=3.0, timeout=6.0, clock=clock)
+    tx, rx = s.connect('artemis', connect=mock_connect, liveness=liveness)
+    with assert_raises(LinkTimeout):
+        next(rx)
+    eq_(timeouts, [3.0, 3.0, s.MIN_TIMEOUT])
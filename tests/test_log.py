@@ -0,0 +1,55 @@
+import io
+import threading
+import diana.packet as p
+from diana.log import PacketLog
+from nose.tools import *
+
+def frame(pkt):
+    return pkt.packet_id, p.encode(pkt, provenance=p.PacketProvenance.server)
+
+def test_frames_formatted_on_close():
+    out = io.StringIO()
+    log = PacketLog(out)
+    log.log_frame('[C<S]', *frame(p.GameEndPacket()))
+    log.log(None, p.GameStartPacket())
+    log.close()
+    eq_(out.getvalue(), '[C<S] <GameEndPacket>\n<GameStartPacket>\n')
+    eq_(log.written, 2)
+
+def test_sampling():
+    out = io.StringIO()
+    log = PacketLog(out, sample={p.HeartbeatPacket: 3, p.GameMessagePacket: 0})
+    for _ in range(7):
+        log.log_frame('', *frame(p.HeartbeatPacket()))
+        log.log_frame('', *frame(p.GameEndPacket()))
+    log.close()
+    eq_(log.written, 3)
+
+def test_truncate():
+    out = io.StringIO()
+    log = PacketLog(out, truncate=5)
+    log.log(None, p.GameStartPacket())
+    log.close()
+    eq_(out.getvalue(), '<Game...\n')
+
+class BlockedStream:
+    def __init__(self):
+        self.gate = threading.Event()
+        self.data = []
+
+    def write(self, data):
+        self.gate.wait()
+        self.data.append(data)
+
+    def flush(self):
+        pass
+
+def test_full_queue_drops():
+    stream = BlockedStream()
+    log = PacketLog(stream, maxsize=2, batch=1)
+    for _ in range(10):
+        log.log(None, p.GameStartPacket())
+    assert log.dropped >= 7
+    stream.gate.set()
+    log.close()
+    eq_(log.written + log.dropped, 10)
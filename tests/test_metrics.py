@@ -0,0 +1,49 @@
+import diana.packet as p
+from diana import metrics
+from diana.framing import Framer
+from diana.metrics import Metrics, Histogram
+from diana.tracking import Tracker
+from nose.tools import *
+
+def test_histogram_buckets():
+    histogram = Histogram()
+    for value in (0.3, 0.5, 3.0):
+        histogram.observe(value)
+    eq_(list(histogram.cumulative()), [(0.5, 2), (4.0, 3)])
+    eq_(histogram.count, 3)
+
+def test_disabled_by_default():
+    eq_(metrics.registry, None)
+
+def test_prometheus_export():
+    registry = Metrics()
+    registry.inc('frames_total', 'HeartbeatPacket', 2)
+    registry.set('tracker_objects', None, 4)
+    registry.observe('decode_seconds', 'HeartbeatPacket', 0.75)
+    text = registry.prometheus()
+    assert '# TYPE diana_frames_total counter\n' in text
+    assert 'diana_frames_total{type="HeartbeatPacket"} 2\n' in text
+    assert 'diana_tracker_objects 4\n' in text
+    assert 'diana_decode_seconds_bucket{type="HeartbeatPacket",le="1.0"} 1\n' in text
+    assert 'diana_decode_seconds_bucket{type="HeartbeatPacket",le="+Inf"} 1\n' in text
+    assert 'diana_decode_seconds_count{type="HeartbeatPacket"} 1\n' in text
+
+def test_instrumented_receive_path():
+    registry = metrics.enable()
+    try:
+        framer = Framer(p.PacketProvenance.server)
+        update = p.encode(p.ObjectUpdatePacket(b'\x06\x01\x00\x00\x00\x01\x00\x00\x80\x3f\x00\x00\x00\x00'),
+                          provenance=p.PacketProvenance.server)
+        framer.feed(b'junk' + update)
+        tracker = Tracker()
+        for pkt in framer.packets():
+            tracker.rx(pkt)
+        result = registry.as_dict()
+        eq_(result['frames_total'], {'ObjectUpdatePacket': 1})
+        eq_(result['bytes_total'], {'ObjectUpdatePacket': len(update)})
+        eq_(result['resyncs_total'], {None: 1})
+        eq_(result['decode_seconds']['ObjectUpdatePacket']['count'], 1)
+        eq_(result['object_update_records_total'], {None: 1})
+        eq_(result['tracker_objects'], {None: 1})
+    finally:
+        metrics.disable()
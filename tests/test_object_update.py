@@ -0,0 +1,24 @@
+from diana.enumerations import *
+from diana.object_update import decode_obj_update_packet, encode_obj_update_packet
+from nose.tools import *
+
+def test_encode_round_trip():
+    records = [{'object': 5, 'type': ObjectType.other_ship, 'name': 'Bob',
+                'x': 1.0, 'y': 2.0, 'z': 3.0, 'iff-friendly': True,
+                'elite': {EliteAbility.stealth}, 'scanned': True},
+               {'object': 6, 'type': ObjectType.drone, 'x': 1.0, 'y': 2.0, 'heading': 0.5},
+               {'object': 7, 'type': ObjectType.player_vessel, 'red-alert': True,
+                'main-view': MainView(0), 'drive-type': DriveType.jump, 'name': 'Artemis'},
+               {'object': 8, 'type': ObjectType.engineering_console,
+                'heat-beams': 0.5, 'energy-beams': 1.0, 'coolant-beams': 2},
+               {'object': 9, 'type': ObjectType.weapons_console,
+                'status-5': TubeStatus(0), 'contents-5': OrdnanceType(1)}]
+    eq_(decode_obj_update_packet(encode_obj_update_packet(records)), records)
+
+def test_encode_skips_unknown_fields():
+    records = [{'object': 3, 'type': ObjectType.mine, 'x': 4.0, 'intel': 'Minefield'}]
+    eq_(decode_obj_update_packet(encode_obj_update_packet(records)),
+        [{'object': 3, 'type': ObjectType.mine, 'x': 4.0}])
+
+def test_encode_unknown_type():
+    assert_raises(ValueError, encode_obj_update_packet, [{'object': 1, 'type': ObjectType.mesh}])
@@ -0,0 +1,89 @@
+import diana.packet as p
+from diana.outbound import SendQueue, QueueFull
+from nose.tools import *
+
+def test_superseded_commands_coalesce():
+    queue = SendQueue()
+    queue.put(p.HelmSetSteeringPacket(0.1))
+    queue.put(p.HelmRequestDockPacket())
+    queue.put(p.HelmSetSteeringPacket(0.2))
+    queue.put(p.HelmSetSteeringPacket(0.3))
+    eq_(len(queue), 2)
+    eq_(queue.take(), p.encode(p.HelmRequestDockPacket()) +
+                      p.encode(p.HelmSetSteeringPacket(0.3)))
+    eq_(len(queue), 0)
+
+def test_discrete_actions_keep_order():
+    queue = SendQueue()
+    queue.put(p.ToggleShieldsPacket())
+    queue.put(p.ToggleShieldsPacket())
+    queue.put(p.ReadyPacket())
+    eq_(queue.take(), p.encode(p.ToggleShieldsPacket()) * 2 + p.encode(p.ReadyPacket()))
+
+def test_climb_dive_nudges_are_not_coalesced():
+    queue = SendQueue()
+    queue.put(p.ClimbDivePacket(-1))
+    queue.put(p.ClimbDivePacket(-1))
+    queue.put(p.ClimbDivePacket(1))
+    eq_(queue.take(), p.encode(p.ClimbDivePacket(-1)) * 2 + p.encode(p.ClimbDivePacket(1)))
+
+def test_console_selection_coalesces_per_console():
+    queue = SendQueue()
+    queue.put(p.SetConsolePacket(p.Console.helm, True))
+    queue.put(p.SetConsolePacket(p.Console.weapons, True))
+    queue.put(p.SetConsolePacket(p.Console.helm, False))
+    eq_(queue.take(), p.encode(p.SetConsolePacket(p.Console.weapons, True)) +
+                      p.encode(p.SetConsolePacket(p.Console.helm, False)))
+
+def test_flush_is_one_write():
+    writes = []
+    queue = SendQueue(write=writes.append)
+    queue.put(p.HelmSetImpulsePacket(0.5))
+    queue.put(p.HelmSetWarpPacket(2))
+    queue.flush()
+    queue.flush()
+    eq_(writes, [p.encode(p.HelmSetImpulsePacket(0.5)) + p.encode(p.HelmSetWarpPacket(2))])
+
+def test_high_priority_first():
+    queue = SendQueue()
+    queue.put(p.TogglePerspectivePacket())
+    queue.put(p.ReadyPacket())
+    queue.put(p.ToggleShieldsPacket())
+    eq_(queue.take(), p.encode(p.ToggleShieldsPacket()) +
+                      p.encode(p.ReadyPacket()) +
+                      p.encode(p.TogglePerspectivePacket()))
+
+def test_bounded_queue_drops_lowest():
+    queue = SendQueue(maxlen=2)
+    queue.put(p.TogglePerspectivePacket())
+    queue.put(p.ReadyPacket())
+    assert queue.put(p.ToggleShieldsPacket())
+    eq_(queue.dropped, 1)
+    assert not queue.put(p.TogglePerspectivePacket())
+    eq_(queue.dropped, 2)
+    eq_(queue.take(), p.encode(p.ToggleShieldsPacket()) + p.encode(p.ReadyPacket()))
+
+def test_bounded_queue_drop_newest_and_error():
+    queue = SendQueue(maxlen=1, policy='newest')
+    queue.put(p.ReadyPacket())
+    assert not queue.put(p.ToggleShieldsPacket())
+    eq_(queue.take(), p.encode(p.ReadyPacket()))
+    queue = SendQueue(maxlen=1, policy='error')
+    queue.put(p.ReadyPacket())
+    with assert_raises(QueueFull):
+        queue.put(p.ReadyPacket())
+
+def test_coalescing_does_not_count_against_bound():
+    queue = SendQueue(maxlen=1, policy='newest')
+    queue.put(p.HelmSetSteeringPacket(0.1))
+    assert queue.put(p.HelmSetSteeringPacket(0.2))
+    eq_(queue.take(), p.encode(p.HelmSetSteeringPacket(0.2)))
+
+def test_take_with_byte_budget():
+    queue = SendQueue()
+    queue.put(p.ReadyPacket())
+    queue.put(p.ToggleShieldsPacket())
+    first = queue.take(max_bytes=40)
+    eq_(first, p.encode(p.ToggleShieldsPacket()))
+    eq_(len(queue), 1)
+    eq_(queue.take(), p.encode(p.ReadyPacket()))
@@ -0,0 +1,62 @@
+import diana.packet as p
+import diana.socket as s
+from diana.pipeline import PipelinedReceiver
+import socket
+import struct
+from nose.tools import *
+
+WELCOME = b'\xef\xbe\xad\xde+\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x17\x00\x00\x00\xda\xb3\x04m\x0f\x00\x00\x00Welcome to eyes'
+
+def server_frame(pack):
+    return p.encode(pack, provenance=p.PacketProvenance.server)
+
+def test_pipeline_preserves_order():
+    ours, theirs = socket.socketpair()
+    messages = ['message {}'.format(n) for n in range(200)]
+    theirs.sendall(b''.join(server_frame(p.WelcomePacket(message)) for message in messages))
+    theirs.close()
+    receiver = PipelinedReceiver(ours, workers=4, depth=8)
+    eq_([packet.message for packet in receiver], messages)
+    metrics = receiver.metrics()
+    eq_(metrics['frames_read'], 200)
+    eq_(metrics['delivered'], 200)
+    eq_(metrics['delivery_depth'], 0)
+    ours.close()
+
+def test_pipeline_predecodes_object_updates():
+    ours, theirs = socket.socketpair()
+    update = p.ObjectUpdatePacket(struct.pack('<BIBfff', 0x06, 7, 0x07, 1.0, 2.0, 3.0))
+    theirs.sendall(server_frame(update))
+    theirs.close()
+    packets = list(PipelinedReceiver(ours, workers=1))
+    eq_(packets[0]._decoded[0]['object'], 7)
+    ours.close()
+
+def test_connect_with_decode_workers():
+    pairs = []
+    def pair_connect(address):
+        ours, theirs = socket.socketpair()
+        pairs.append(theirs)
+        return ours
+    tx, rx = s.connect('artemis', connect=pair_connect, decode_workers=2)
+    pairs[0].sendall(WELCOME)
+    eq_(next(rx).message, 'Welcome to eyes')
+    pairs[0].close()
+    eq_(list(rx), [])
+    eq_(rx.sock.fileno(), -1)
+
+def test_close_stops_blocked_reader():
+    ours, theirs = socket.socketpair()
+    theirs.sendall(b''.join(server_frame(p.WelcomePacket('x')) for _ in range(50)))
+    receiver = PipelinedReceiver(ours, workers=1, depth=2)
+    eq_(next(receiver).message, 'x')
+    receiver.close()
+    assert not receiver.reader.is_alive()
+    eq_(ours.fileno(), -1)
+    eq_(list(receiver), [])
+    theirs.close()
+
+def test_connect_rejects_queue_with_decode_workers():
+    from diana.outbound import SendQueue
+    assert_raises(ValueError, s.connect, 'artemis', connect=lambda address: None,
+                  queue=SendQueue(), decode_workers=2)
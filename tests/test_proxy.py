@@ -0,0 +1,109 @@
+import asyncio
+import diana.packet as p
+from diana.utils.proxy import transit
+from nose.tools import *
+
+class Writer:
+    def __init__(self):
+        self.data = b''
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    def writelines(self, data):
+        self.data += b''.join(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+def run_transit(chunks, **kwargs):
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        reader = asyncio.StreamReader()
+        for chunk in chunks:
+            reader.feed_data(chunk)
+        reader.feed_eof()
+        writer = Writer()
+        logged = []
+        loop.run_until_complete(transit(reader, writer, p.PacketProvenance.client,
+                                        '[C>S]', log=lambda *args: logged.append(args),
+                                        **kwargs))
+        loop.run_until_complete(asyncio.sleep(0))
+        return writer, logged
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+def test_passthrough_is_byte_exact():
+    # a steering value that does not survive a float round trip untouched
+    frame = p.encode(p.HelmSetSteeringPacket(0.5))[:-4] + b'\x01\x00\xc0\x7f'
+    stream = frame + p.encode(p.ReadyPacket())
+    writer, logged = run_transit([stream[:10], stream[10:]])
+    eq_(writer.data, stream)
+    assert writer.closed
+    eq_(len(logged), 2)
+
+def test_passthrough_holds_partial_frames():
+    stream = p.encode(p.ReadyPacket())
+    writer, logged = run_transit([stream[:-1]])
+    eq_(writer.data, b'')
+
+def test_reencode_mode():
+    stream = p.encode(p.ReadyPacket())
+    writer, logged = run_transit([stream], mode='reencode')
+    eq_(writer.data, stream)
+
+def test_spectators_share_upstream():
+    from diana.fanout import FanOut
+    from diana.utils.proxy import broadcast, spectate
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        hub = FanOut()
+        hub.publish(p.GameStartPacket.packet_id,
+                    p.encode(p.GameStartPacket(), provenance=p.PacketProvenance.server))
+        writers = [Writer(), Writer()]
+        spectators = []
+        for writer in writers:
+            spectators.append(loop.create_task(spectate(hub, asyncio.StreamReader(), writer)))
+        loop.run_until_complete(asyncio.sleep(0))
+        heartbeat = p.encode(p.HeartbeatPacket(), provenance=p.PacketProvenance.server)
+        upstream = asyncio.StreamReader()
+        upstream.feed_data(heartbeat)
+        upstream.feed_eof()
+        loop.run_until_complete(asyncio.gather(broadcast(hub, upstream, log=None), *spectators))
+        for writer in writers:
+            assert writer.closed
+            eq_(writer.data, p.encode(p.GameStartPacket(), provenance=p.PacketProvenance.server) +
+                             heartbeat)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+def test_spectator_after_upstream_closed():
+    from diana.fanout import FanOut
+    from diana.utils.proxy import spectate
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        hub = FanOut()
+        hub.close()
+        writer = Writer()
+        loop.run_until_complete(asyncio.wait_for(spectate(hub, asyncio.StreamReader(), writer), 1))
+        assert writer.closed
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+def test_rules_filter_forwarded_frames():
+    from diana.rules import Rule, RuleSet, Drop
+    rules = RuleSet([Rule(p.HelmJumpPacket, Drop())])
+    ready = p.encode(p.ReadyPacket())
+    writer, logged = run_transit([p.encode(p.HelmJumpPacket(1.0, 2.0)) + ready], rules=rules)
+    eq_(writer.data, ready)
+    eq_(len(logged), 2)
@@ -0,0 +1,57 @@
+import diana.packet as p
+from diana.framing import Framer
+from diana.rules import Rule, RuleSet, Drop, Rewrite, RateLimit, Inject
+from nose.tools import *
+
+def frame(pkt):
+    return pkt.packet_id, p.encode(pkt)
+
+def packets(frames):
+    framer = Framer(p.PacketProvenance.client)
+    framer.feed(b''.join(frames))
+    return list(framer.packets())
+
+def test_subpacket_registry():
+    eq_(p.HelmJumpPacket.subtype, 5)
+    assert p.ShipAction1Packet.SUBPACKETS[1] is p.SetMainScreenPacket
+
+def test_unmatched_passes_through_undecoded():
+    rules = RuleSet([Rule(p.HelmJumpPacket, Drop())])
+    ptype, data = frame(p.ReadyPacket())
+    assert rules.apply(ptype, data)[0] is data
+    # same packet id, different subtype
+    ptype, data = frame(p.HelmSetImpulsePacket(0.5))
+    assert rules.apply(ptype, data)[0] is data
+
+def test_drop_by_subtype():
+    rules = RuleSet([Rule(p.HelmJumpPacket, Drop())])
+    eq_(rules.apply(*frame(p.HelmJumpPacket(1.0, 2.0))), [])
+    eq_(rules.matched, 1)
+
+def test_parent_matches_all_subtypes():
+    rules = RuleSet([Rule(p.ShipAction3Packet, Drop())])
+    eq_(rules.apply(*frame(p.HelmSetImpulsePacket(0.5))), [])
+
+def test_where_predicates():
+    rules = RuleSet([Rule(p.HelmSetWarpPacket, Drop(), where={'warp': lambda w: w > 2})])
+    eq_(rules.apply(*frame(p.HelmSetWarpPacket(4))), [])
+    eq_(len(rules.apply(*frame(p.HelmSetWarpPacket(1)))), 1)
+
+def test_rewrite():
+    rules = RuleSet([Rule(p.SetMainScreenPacket, Rewrite({'screen': p.MainView.forward}))])
+    pkt, = packets(rules.apply(*frame(p.SetMainScreenPacket(p.MainView.lrs))))
+    eq_(pkt.screen, p.MainView.forward)
+
+def test_rate_limit():
+    now = [0.0]
+    rules = RuleSet([Rule(p.ReadyPacket, RateLimit(1.0, burst=2, clock=lambda: now[0]))])
+    sent = [len(rules.apply(*frame(p.ReadyPacket()))) for _ in range(3)]
+    eq_(sent, [1, 1, 0])
+    now[0] = 1.0
+    eq_(len(rules.apply(*frame(p.ReadyPacket()))), 1)
+
+def test_inject_and_first_match_wins():
+    rules = RuleSet([Rule(p.ReadyPacket, Inject([p.ToggleRedAlertPacket()])),
+                     Rule(p.ReadyPacket, Drop())])
+    result = packets(rules.apply(*frame(p.ReadyPacket())))
+    eq_([type(pkt) for pkt in result], [p.ReadyPacket, p.ToggleRedAlertPacket])
@@ -1,5 +1,7 @@
 import diana.socket as s
 import diana.packet as p
+from diana.outbound import SendQueue
+from diana.tracking import Tracker
 import socket
 from nose.tools import *
 
@@ -25,11 +27,168 @@ def test_transmit_socket():
 def test_recv_socket():
     def mock_connect(address):
         class MockFD:
-            def recv(self, maxlen):
-                return b'\xef\xbe\xad\xde+\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x17\x00\x00\x00\xda\xb3\x04m\x0f\x00\x00\x00Welcome to eyes'
+            def recv_into(self, buffer):
+                data = b'\xef\xbe\xad\xde+\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x17\x00\x00\x00\xda\xb3\x04m\x0f\x00\x00\x00Welcome to eyes'
+                buffer[:len(data)] = data
+                return len(data)
+            def close(self):
+                pass
         return MockFD()
     tx, rx = s.connect('artemis', 2210, connect=mock_connect)
     packet = next(rx)
     assert isinstance(packet, p.WelcomePacket)
     eq_(packet.message, 'Welcome to eyes')
 
+
+WELCOME = b'\xef\xbe\xad\xde+\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00\x17\x00\x00\x00\xda\xb3\x04m\x0f\x00\x00\x00Welcome to eyes'
+
+def chunked_socket(chunks):
+    chunks = list(chunks)
+    def mock_connect(address):
+        class MockFD:
+            closed = False
+            def close(self):
+                self.closed = True
+            def recv_into(self, buffer):
+                if not chunks:
+                    return 0
+                data = chunks.pop(0)
+                buffer[:len(data)] = data
+                return len(data)
+        return MockFD()
+    return mock_connect
+
+def test_recv_split_frames():
+    stream = WELCOME * 3
+    chunks = [stream[:10], stream[10:50], stream[50:51], stream[51:]]
+    tx, rx = s.connect('artemis', 2210, connect=chunked_socket(chunks))
+    packets = list(rx)
+    eq_(len(packets), 3)
+    for packet in packets:
+        eq_(packet.message, 'Welcome to eyes')
+
+def test_recv_ends_on_close():
+    socks = []
+    connect = chunked_socket([WELCOME[:20]])
+    tx, rx = s.connect('artemis', 2210, connect=lambda address: socks.append(connect(address)) or socks[0])
+    eq_(list(rx), [])
+    assert socks[0].closed
+
+def test_multiplexer_poll_and_send():
+    pairs = []
+    def pair_connect(address):
+        ours, theirs = socket.socketpair()
+        pairs.append(theirs)
+        return ours
+    mux = s.Multiplexer(connect=pair_connect)
+    first = mux.add('alpha', 2010)
+    second = mux.add('beta', 2010)
+    pairs[1].sendall(WELCOME + WELCOME[:10])
+    results = mux.poll(1.0)
+    eq_([(connection, len(packets)) for connection, packets in results], [(second, 1)])
+    first.send(p.ReadyPacket())
+    mux.poll(0.1)
+    eq_(pairs[0].recv(1024), p.encode(p.ReadyPacket()))
+    pairs[1].close()
+    results = mux.poll(1.0)
+    eq_(results, [(second, [])])
+    assert second.closed
+    eq_(mux.connections, [first])
+    mux.close()
+    pairs[0].close()
+
+def test_queued_transmit_flushes_before_read():
+    writes = []
+    def mock_connect(address):
+        class MockFD:
+            def sendall(self, data):
+                writes.append(data)
+            def settimeout(self, timeout):
+                pass
+            def recv_into(self, buffer):
+                return 0
+            def close(self):
+                pass
+        return MockFD()
+    queue = SendQueue()
+    tx, rx = s.connect('artemis', 2210, connect=mock_connect, queue=queue)
+    tx(p.HelmSetSteeringPacket(0.1))
+    tx(p.HelmSetSteeringPacket(0.2))
+    eq_(writes, [])
+    eq_(list(rx), [])
+    eq_(writes, [p.encode(p.HelmSetSteeringPacket(0.2))])
+
+def test_queued_transmit_flushes_on_quiet_link():
+    writes = []
+    timeouts = []
+    def mock_connect(address):
+        class MockFD:
+            def sendall(self, data):
+                writes.append(data)
+            def settimeout(self, timeout):
+                timeouts.append(timeout)
+            def recv_into(self, buffer):
+                if len(timeouts) == 1:
+                    # nothing arrives; meanwhile the helm queues a command
+                    tx(p.HelmSetImpulsePacket(0.5))
+                    raise socket.timeout()
+                return 0
+            def close(self):
+                pass
+        return MockFD()
+    tx, rx = s.connect('artemis', 2210, connect=mock_connect, queue=SendQueue(),
+                       flush_interval=0.01)
+    eq_(list(rx), [])
+    eq_(timeouts, [0.01, 0.01])
+    eq_(writes, [p.encode(p.HelmSetImpulsePacket(0.5))])
+
+def test_reconnecting_client_replays_setup():
+    sessions = []
+    def flaky_connect(address):
+        if len(sessions) == 1:
+            sessions.append(None)
+            raise ConnectionRefusedError()
+        chunks = [WELCOME]
+        class MockFD:
+            def __init__(self):
+                self.sent = b''
+                self.closed = False
+            def close(self):
+                self.closed = True
+            def send(self, data):
+                self.sent += data
+            def recv_into(self, buffer):
+                if not chunks:
+                    raise ConnectionResetError()
+                data = chunks.pop(0)
+                buffer[:len(data)] = data
+                return len(data)
+        sock = MockFD()
+        sessions.append(sock)
+        return sock
+    delays = []
+    tracker = Tracker()
+    tracker.update_object({'object': 1, 'type': p.ObjectType.base})
+    client = s.ReconnectingClient('artemis', connect=flaky_connect, tracker=tracker,
+                                  setup=[p.SetShipPacket(2)], sleep=delays.append,
+                                  random=lambda: 0.0)
+    rx = client.rx()
+    eq_(next(rx).message, 'Welcome to eyes')
+    eq_(next(rx).message, 'Welcome to eyes')
+    eq_(delays, [0.5, 1.0])
+    eq_(tracker.stale, {1})
+    assert sessions[0].closed
+    eq_(set(tracker.objects), {1})
+    eq_(sessions[0].sent, p.encode(p.SetShipPacket(2)))
+    eq_(sessions[2].sent, p.encode(p.SetShipPacket(2)))
+
+def test_backoff_is_capped_and_jittered():
+    client = s.ReconnectingClient('artemis', initial_delay=1.0, max_delay=8.0,
+                                  random=lambda: 1.0, jitter=0.5)
+    client.attempts = 10
+    eq_(client.backoff(), 4.0)
+
+def test_backoff_after_long_outage():
+    client = s.ReconnectingClient('artemis', random=lambda: 0.0)
+    client.attempts = 1100
+    eq_(client.backoff(), 30.0)
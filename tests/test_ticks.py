@@ -0,0 +1,55 @@
+import diana.packet as p
+from diana.ticks import TickBatcher
+from diana.tracking import Tracker
+import struct
+from nose.tools import *
+
+def mine_update(oid, x):
+    return p.ObjectUpdatePacket(struct.pack('<BIBf', 0x06, oid, 0x01, x))
+
+def test_gap_closes_tick():
+    batcher = TickBatcher(gap=0.01, timeout=1.0)
+    eq_(batcher.push(mine_update(1, 1.0), now=0.0), [])
+    eq_(batcher.push(mine_update(1, 2.0), now=0.001), [])
+    eq_(batcher.push(mine_update(2, 3.0), now=0.002), [])
+    ticks = batcher.push(mine_update(1, 4.0), now=0.1)
+    eq_(len(ticks), 1)
+    tick = ticks[0]
+    eq_(len(tick.packets), 3)
+    eq_(tick.updates[1]['x'], 2.0)
+    eq_(tick.updates[2]['x'], 3.0)
+    eq_((tick.start, tick.end), (0.0, 0.002))
+
+def test_timeout_and_poll():
+    batcher = TickBatcher(gap=1.0, timeout=0.05)
+    batcher.push(mine_update(1, 1.0), now=0.0)
+    batcher.push(mine_update(1, 1.0), now=0.04)
+    eq_(len(batcher.poll(now=0.06)), 1)
+    eq_(batcher.poll(now=0.07), [])
+
+def test_heartbeat_boundary_and_subscribers():
+    seen = []
+    batcher = TickBatcher(gap=1.0, timeout=1.0)
+    batcher.subscribe(seen.append)
+    batcher.push(mine_update(1, 1.0), now=0.0)
+    ticks = batcher.push(p.HeartbeatPacket(), now=0.0)
+    eq_(len(ticks), 1)
+    eq_(seen, ticks)
+
+def test_destroy_in_tick():
+    batcher = TickBatcher()
+    batcher.push(mine_update(1, 1.0), now=0.0)
+    batcher.push(p.DestroyObjectPacket(type=p.ObjectType.mine, object=1), now=0.0)
+    tick, = batcher.flush()
+    eq_(tick.updates, {})
+    eq_(len(tick.events), 1)
+
+def test_tracker_rx_tick():
+    tracker = Tracker()
+    batcher = TickBatcher(gap=10.0, timeout=10.0)
+    batcher.subscribe(tracker.rx_tick)
+    packets = [mine_update(1, 1.0), mine_update(1, 2.0), p.IntelPacket(object=1, intel='m')]
+    ticks = list(batcher.batches(iter(packets)))
+    eq_(len(ticks), 1)
+    eq_(tracker.objects[1]['x'], 2.0)
+    eq_(tracker.objects[1]['intel'], 'm')
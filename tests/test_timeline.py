@@ -0,0 +1,59 @@
+from diana.timeline import Timeline
+from diana.tracking import Tracker
+import diana.packet as p
+from nose.tools import *
+
+def _timeline():
+    timeline = Timeline(keyframe_interval=10.0)
+    for t in range(0, 40):
+        timeline.record({'object': 1, 'x': float(t)}, t=float(t))
+        if t == 5:
+            timeline.record({'object': 2, 'name': 'Artemis', 'x': 1.0}, t=5.0)
+        if t == 25:
+            timeline.destroy(2, t=25.0)
+    return timeline
+
+def test_state_at():
+    timeline = _timeline()
+    eq_(timeline.state_at(-1.0), {})
+    eq_(timeline.state_at(3.5)[1]['x'], 3.0)
+    state = timeline.state_at(17.0)
+    eq_(state[1]['x'], 17.0)
+    eq_(state[2]['name'], 'Artemis')
+    assert 2 not in timeline.state_at(25.0)
+
+def test_state_at_uses_keyframes():
+    timeline = _timeline()
+    eq_(len(timeline.keyframes), 4)
+    eq_(timeline.state_at(39.0)[1]['x'], 39.0)
+
+def test_history():
+    timeline = _timeline()
+    eq_(timeline.history(1, 'x', 3.0, 5.0), [(3.0, 3.0), (4.0, 4.0), (5.0, 5.0)])
+    eq_(timeline.history(2, 'name', 0.0, 100.0), [(5.0, 'Artemis')])
+    eq_(timeline.history(1, 'bees', 0.0, 100.0), [])
+    eq_(timeline.history(99, 'x', 0.0, 100.0), [])
+
+def test_reset_clears_state():
+    timeline = Timeline()
+    timeline.record({'object': 1, 'x': 1.0}, t=1.0)
+    timeline.reset(t=2.0)
+    timeline.record({'object': 3, 'x': 1.0}, t=3.0)
+    eq_(set(timeline.state_at(1.5)), {1})
+    eq_(set(timeline.state_at(3.0)), {3})
+
+def test_out_of_order_rejected():
+    timeline = Timeline()
+    timeline.record({'object': 1, 'x': 1.0}, t=2.0)
+    with assert_raises(ValueError):
+        timeline.record({'object': 1, 'x': 1.0}, t=1.0)
+
+def test_tracker_feeds_timeline():
+    now = [0.0]
+    timeline = Timeline()
+    tracker = Tracker(clock=lambda: now[0], timeline=timeline)
+    tracker.update_object({'object': 1, 'type': p.ObjectType.mine, 'x': 1.0})
+    now[0] = 5.0
+    tracker.remove_object(1)
+    eq_(timeline.state_at(1.0)[1]['x'], 1.0)
+    eq_(timeline.state_at(5.0), {})
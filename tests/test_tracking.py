@@ -0,0 +1,422 @@
+import diana.packet as p
+from diana import checkpoint
+from diana.tracking import Tracker, ConcurrentTracker, Query
+from nose.tools import *
+import math
+import os
+import struct
+import tempfile
+import threading
+
+def mine_update(oid, x, y, z):
+    return p.ObjectUpdatePacket(struct.pack('<BIBfff', 0x06, oid, 0x07, x, y, z))
+
+def test_snapshot_is_immutable():
+    tracker = Tracker()
+    tracker.update_object({'object': 1, 'type': p.ObjectType.mine, 'x': 1.0})
+    snap = tracker.snapshot()
+    eq_(snap[1]['x'], 1.0)
+    with assert_raises(TypeError):
+        snap[1]['x'] = 2.0
+
+def test_snapshot_unaffected_by_later_updates():
+    tracker = Tracker()
+    tracker.update_object({'object': 1, 'type': p.ObjectType.mine, 'x': 1.0})
+    old = tracker.snapshot()
+    tracker.update_object({'object': 1, 'x': 2.0})
+    tracker.update_object({'object': 2, 'type': p.ObjectType.mine, 'x': 3.0})
+    new = tracker.snapshot()
+    eq_(old[1]['x'], 1.0)
+    eq_(len(old), 1)
+    eq_(new[1]['x'], 2.0)
+    eq_(len(new), 2)
+    assert new.version > old.version
+
+def test_snapshot_shares_unchanged_objects():
+    tracker = Tracker()
+    tracker.update_object({'object': 1, 'type': p.ObjectType.mine, 'x': 1.0})
+    tracker.update_object({'object': 2, 'type': p.ObjectType.mine, 'x': 2.0})
+    old = tracker.snapshot()
+    tracker.update_object({'object': 2, 'x': 4.0})
+    new = tracker.snapshot()
+    assert old[1] is new[1]
+    assert old[2] is not new[2]
+
+def test_snapshot_without_changes_is_reused():
+    tracker = Tracker()
+    tracker.update_object({'object': 1, 'type': p.ObjectType.mine})
+    assert tracker.snapshot() is tracker.snapshot()
+
+def test_snapshot_drops_destroyed_objects():
+    tracker = Tracker()
+    tracker.update_object({'object': 1, 'type': p.ObjectType.mine})
+    old = tracker.snapshot()
+    tracker.rx(p.DestroyObjectPacket(type=p.ObjectType.mine, object=1))
+    new = tracker.snapshot()
+    assert 1 in old
+    assert 1 not in new
+    eq_(len(new), 0)
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_position_at_extrapolates():
+    clock = FakeClock(10.0)
+    tracker = Tracker(clock=clock)
+    tracker.update_object({'object': 1, 'type': p.ObjectType.other_ship,
+                           'x': 100.0, 'y': 5.0, 'z': 200.0,
+                           'heading': 0.0, 'speed': 2.0})
+    x, y, z = tracker.position_at(1, 13.0)
+    assert_almost_equal(x, 100.0)
+    eq_(y, 5.0)
+    assert_almost_equal(z, 206.0)
+
+def test_position_at_stationary():
+    tracker = Tracker(clock=FakeClock(0.0))
+    tracker.update_object({'object': 1, 'type': p.ObjectType.base,
+                           'x': 1.0, 'y': 2.0, 'z': 3.0})
+    eq_(tracker.position_at(1, 50.0), (1.0, 2.0, 3.0))
+
+def test_positions_at_bulk():
+    clock = FakeClock(0.0)
+    tracker = Tracker(clock=clock)
+    tracker.update_object({'object': 1, 'type': p.ObjectType.base,
+                           'x': 1.0, 'y': 0.0, 'z': 1.0})
+    tracker.update_object({'object': 2, 'type': p.ObjectType.other_ship,
+                           'x': 0.0, 'y': 0.0, 'z': 0.0,
+                           'heading': 0.0, 'speed': 1.0})
+    tracker.update_object({'object': 3, 'intel': 'no position'})
+    clock.now = 4.0
+    positions = tracker.positions_at()
+    eq_(set(positions), {1, 2})
+    eq_(positions[1], (1.0, 0.0, 1.0))
+    assert_almost_equal(positions[2][2], 4.0)
+
+def test_position_timestamp_follows_position_updates():
+    clock = FakeClock(0.0)
+    tracker = Tracker(clock=clock)
+    tracker.update_object({'object': 1, 'type': p.ObjectType.other_ship,
+                           'x': 0.0, 'y': 0.0, 'z': 0.0,
+                           'heading': 0.0, 'speed': 1.0})
+    clock.now = 5.0
+    tracker.update_object({'object': 1, 'z': 5.0})
+    assert_almost_equal(tracker.position_at(1, 6.0)[2], 6.0)
+
+def test_position_after_speed_only_update():
+    clock = FakeClock(0.0)
+    tracker = Tracker(clock=clock)
+    tracker.update_object({'object': 1, 'type': p.ObjectType.other_ship,
+                           'x': 0.0, 'y': 0.0, 'z': 0.0})
+    clock.now = 100.0
+    tracker.update_object({'object': 1, 'speed': 1.0})
+    eq_(tracker.position_at(1, 100.0), (0.0, 0.0, 0.0))
+    assert_almost_equal(tracker.position_at(1, 110.0)[2], 10.0)
+    clock.now = 120.0
+    tracker.update_object({'object': 1, 'speed': 0.0})
+    assert_almost_equal(tracker.position_at(1, 200.0)[2], 20.0)
+    assert_almost_equal(tracker.positions_at(200.0)[1][2], 20.0)
+
+def test_position_after_heading_only_update():
+    clock = FakeClock(0.0)
+    tracker = Tracker(clock=clock)
+    tracker.update_object({'object': 1, 'type': p.ObjectType.other_ship,
+                           'x': 0.0, 'y': 0.0, 'z': 0.0,
+                           'heading': 0.0, 'speed': 1.0})
+    clock.now = 50.0
+    tracker.update_object({'object': 1, 'heading': math.pi / 2})
+    x, y, z = tracker.position_at(1, 50.0)
+    assert_almost_equal(x, 0.0)
+    assert_almost_equal(z, 50.0)
+    x, y, z = tracker.position_at(1, 60.0)
+    assert_almost_equal(x, 10.0)
+    assert_almost_equal(z, 50.0)
+
+def _checkpoint_tracker():
+    tracker = Tracker()
+    tracker.update_object({'object': 1, 'type': p.ObjectType.other_ship,
+                           'x': 1.5, 'iff-side': -1, 'name': 'Kralien',
+                           'scanned': True, 'elite': {p.EliteAbility.cloak,
+                                                       p.EliteAbility.warp}})
+    tracker.update_object({'object': 2, 'type': p.ObjectType.base,
+                           'name': 'DS1', 'intel': 'Friendly'})
+    return tracker
+
+def test_checkpoint_round_trip():
+    tracker = _checkpoint_tracker()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'state.ckpt')
+        tracker.save(path)
+        restored = Tracker()
+        restored.load(path)
+    eq_(restored.objects, tracker.objects)
+
+def test_checkpoint_incremental():
+    tracker = _checkpoint_tracker()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'state.ckpt')
+        tracker.save(path)
+        size = os.path.getsize(path)
+        tracker.update_object({'object': 1, 'x': 9.0})
+        tracker.remove_object(2)
+        tracker.save(path, incremental=True)
+        assert os.path.getsize(path) < 2 * size
+        restored = Tracker()
+        restored.load(path)
+    eq_(restored.objects, tracker.objects)
+    eq_(restored.objects[1]['x'], 9.0)
+
+def test_checkpoint_is_little_endian():
+    segment = checkpoint.encode_segment({0x01020304: {'x': 1.5}})
+    offset = checkpoint.HEADER.size + 5
+    eq_(segment[offset:offset + 4], struct.pack('<I', 0x01020304))
+    assert segment.endswith(struct.pack('<I', 0) + struct.pack('<d', 1.5))
+    swap = checkpoint.SWAP
+    checkpoint.SWAP = not swap
+    try:
+        swapped = checkpoint.encode_segment({0x01020304: {'x': 1.5}})
+        eq_(list(checkpoint.decode_segments(swapped)),
+            [(True, [], {0x01020304: {'x': 1.5}})])
+    finally:
+        checkpoint.SWAP = swap
+    assert swapped != segment
+
+def test_ttl_evicts_stale_objects():
+    clock = FakeClock(0.0)
+    tracker = Tracker(clock=clock, ttl=10.0)
+    tracker.update_object({'object': 1, 'type': p.ObjectType.mine})
+    clock.now = 8.0
+    tracker.update_object({'object': 2, 'type': p.ObjectType.mine})
+    clock.now = 12.0
+    tracker.evict_stale()
+    eq_(set(tracker.objects), {2})
+
+def test_refresh_keeps_object_alive():
+    clock = FakeClock(0.0)
+    tracker = Tracker(clock=clock, ttl=10.0)
+    tracker.update_object({'object': 1, 'type': p.ObjectType.mine})
+    clock.now = 9.0
+    tracker.update_object({'object': 1, 'x': 1.0})
+    clock.now = 15.0
+    tracker.evict_stale()
+    eq_(set(tracker.objects), {1})
+
+def test_max_objects_evicts_least_recently_updated():
+    tracker = Tracker(clock=FakeClock(), max_objects=2)
+    tracker.update_object({'object': 1, 'type': p.ObjectType.mine})
+    tracker.update_object({'object': 2, 'type': p.ObjectType.mine})
+    tracker.update_object({'object': 1, 'x': 1.0})
+    tracker.update_object({'object': 3, 'type': p.ObjectType.mine})
+    eq_(set(tracker.objects), {1, 3})
+
+def test_game_lifecycle_resets_tracker():
+    for lifecycle_packet in (p.GameStartPacket(), p.GameEndPacket()):
+        tracker = Tracker()
+        tracker.update_object({'object': 1, 'type': p.ObjectType.mine, 'x': 1.0})
+        snap = tracker.snapshot()
+        tracker.rx(lifecycle_packet)
+        eq_(tracker.objects, {})
+        eq_(len(tracker.last_seen), 0)
+        eq_(len(tracker.snapshot()), 0)
+        eq_(len(snap), 1)
+
+def test_by_type_index():
+    tracker = Tracker()
+    tracker.update_object({'object': 1, 'type': p.ObjectType.mine})
+    tracker.update_object({'object': 2, 'type': p.ObjectType.base})
+    tracker.update_object({'object': 3, 'intel': 'unknown'})
+    eq_(set(tracker.by_type[p.ObjectType.mine]), {1})
+    tracker.remove_object(1)
+    eq_(tracker.by_type[p.ObjectType.mine], {})
+    tracker.update_object({'object': 3, 'type': p.ObjectType.mine})
+    eq_(set(tracker.by_type[p.ObjectType.mine]), {3})
+
+def test_concurrent_tracker_publishes_per_batch():
+    tracker = ConcurrentTracker()
+    before = tracker.state
+    tracker.rx_batch([p.IntelPacket(object=1, intel='a'),
+                      p.IntelPacket(object=2, intel='b')])
+    eq_(len(before), 0)
+    eq_(len(tracker.state), 2)
+    eq_(tracker.state[2]['intel'], 'b')
+
+def test_concurrent_tracker_readers_with_writer():
+    tracker = ConcurrentTracker(type_locks=True)
+    errors = []
+    def read():
+        try:
+            for _ in range(200):
+                state = tracker.state
+                sum(1 for _ in state.values())
+                with tracker.read_lock(p.ObjectType.mine):
+                    list(tracker.by_type.get(p.ObjectType.mine, {}).values())
+        except Exception as e:
+            errors.append(e)
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for n in range(200):
+        tracker.rx_batch([p.DestroyObjectPacket(type=p.ObjectType.mine, object=n - 1),
+                          mine_update(n, 0.0, 0.0, 0.0)])
+    for reader in readers:
+        reader.join()
+    eq_(errors, [])
+
+def test_concurrent_tracker_publishes_from_every_entry_point():
+    from diana.ticks import Tick
+    tracker = ConcurrentTracker(type_locks=True)
+    tracker.update_records(mine_update(1, 0.0, 0.0, 0.0).records)
+    eq_(len(tracker.state), 1)
+    tick = Tick(0.0, 0.0, 1, [], {2: mine_update(2, 0.0, 0.0, 0.0).records[0]})
+    tracker.rx_tick(tick)
+    eq_(len(tracker.state), 2)
+    tracker.remove_object(1)
+    eq_(set(tracker.state), {2})
+    tracker.mark_stale()
+    eq_(tracker.stale, {2})
+    tracker.reset()
+    eq_(len(tracker.state), 0)
+    tracker.update_object({'object': 3, 'type': p.ObjectType.mine})
+    eq_(set(tracker.state), {3})
+
+def _query_tracker():
+    tracker = Tracker()
+    for oid, (x, z, shields, friendly) in enumerate([(100.0, 100.0, 10.0, False),
+                                                     (200.0, 100.0, 50.0, False),
+                                                     (150.0, 120.0, 5.0, True),
+                                                     (90000.0, 90000.0, 1.0, False)]):
+        tracker.update_object({'object': oid, 'type': p.ObjectType.other_ship,
+                               'x': x, 'y': 0.0, 'z': z, 'shields': shields,
+                               'iff-friendly': friendly})
+    tracker.update_object({'object': 10, 'type': p.ObjectType.mine,
+                           'x': 100.0, 'y': 0.0, 'z': 100.0})
+    return tracker
+
+def test_query_by_type_and_where():
+    tracker = _query_tracker()
+    results = tracker.query(type=p.ObjectType.other_ship,
+                            where={'iff-friendly': False,
+                                   'shields': lambda shields: shields < 20})
+    eq_({obj['object'] for obj in results}, {0, 3})
+
+def test_query_near():
+    tracker = _query_tracker()
+    results = tracker.query(near=(100.0, 100.0, 150.0))
+    eq_({obj['object'] for obj in results}, {0, 1, 2, 10})
+    results = tracker.query(type=p.ObjectType.other_ship, near=(100.0, 100.0, 60.0))
+    eq_({obj['object'] for obj in results}, {0, 2})
+
+def test_query_order_and_limit():
+    tracker = _query_tracker()
+    results = tracker.query(type=p.ObjectType.other_ship, order_by='shields', limit=2)
+    eq_([obj['object'] for obj in results], [3, 2])
+    results = tracker.query(type=p.ObjectType.other_ship, order_by='-shields', limit=1)
+    eq_([obj['object'] for obj in results], [1])
+
+def test_compiled_query_reuse():
+    tracker = _query_tracker()
+    query = Query(type=p.ObjectType.other_ship, where={'iff-friendly': True})
+    eq_(len(query(tracker)), 1)
+    tracker.update_object({'object': 1, 'iff-friendly': True})
+    eq_(len(query(tracker)), 2)
+
+def test_tracker_records_history():
+    clock = FakeClock(0.0)
+    tracker = Tracker(clock=clock, history=2)
+    for n in range(3):
+        clock.now = float(n)
+        tracker.rx(mine_update(1, float(n), 0.0, 0.0))
+    tracker.update_object({'object': 1, 'intel': 'no movement'})
+    eq_(list(tracker.history[1].column('x')), [1.0, 2.0])
+    tracker.remove_object(1)
+    assert 1 not in tracker.history
+
+def torpedo_update(oid, x, z):
+    return p.ObjectUpdatePacket(struct.pack('<BIBff', 0x0a, oid, 0x05, x, z))
+
+def test_proximity_enter_and_leave():
+    tracker = Tracker()
+    tracker.update_object({'object': 1, 'type': p.ObjectType.player_vessel,
+                           'x': 0.0, 'y': 0.0, 'z': 0.0})
+    watch = tracker.watch(p.ObjectType.torpedo, p.ObjectType.player_vessel, 100.0)
+    tracker.rx(torpedo_update(2, 500.0, 0.0))
+    eq_(tracker.drain_proximity_events(), [])
+    tracker.rx(torpedo_update(2, 50.0, 0.0))
+    events = tracker.drain_proximity_events()
+    eq_([(e.kind, e.source, e.target) for e in events], [('enter', 2, 1)])
+    tracker.rx(torpedo_update(2, 60.0, 0.0))
+    eq_(tracker.drain_proximity_events(), [])
+    tracker.rx(torpedo_update(2, 600.0, 0.0))
+    events = tracker.drain_proximity_events()
+    eq_([(e.kind, e.source, e.target) for e in events], [('leave', 2, 1)])
+
+def test_proximity_target_moves():
+    tracker = Tracker()
+    tracker.rx(torpedo_update(2, 0.0, 0.0))
+    seen = []
+    tracker.watch(p.ObjectType.torpedo, 1, 100.0, callback=seen.append)
+    tracker.update_object({'object': 1, 'type': p.ObjectType.player_vessel,
+                           'x': 10.0, 'y': 0.0, 'z': 0.0})
+    tracker.check_proximity()
+    eq_([(e.kind, e.source, e.target) for e in seen], [('enter', 2, 1)])
+
+def test_proximity_callback_events_not_queued():
+    tracker = Tracker()
+    tracker.update_object({'object': 1, 'type': p.ObjectType.player_vessel,
+                           'x': 0.0, 'y': 0.0, 'z': 0.0})
+    seen = []
+    tracker.watch(p.ObjectType.torpedo, p.ObjectType.player_vessel, 100.0,
+                  callback=seen.append)
+    for n in range(100):
+        tracker.rx(torpedo_update(2, 50.0 if n % 2 else 500.0, 0.0))
+    eq_(len(seen), 99)
+    eq_(tracker.proximity_events, [])
+
+def test_proximity_leave_on_destroy():
+    tracker = Tracker()
+    tracker.update_object({'object': 1, 'type': p.ObjectType.player_vessel,
+                           'x': 0.0, 'y': 0.0, 'z': 0.0})
+    tracker.rx(torpedo_update(2, 10.0, 0.0))
+    watch = tracker.watch(p.ObjectType.torpedo, p.ObjectType.player_vessel, 100.0)
+    eq_(watch.pairs, {(2, 1)})
+    tracker.drain_proximity_events()
+    tracker.rx(p.DestroyObjectPacket(type=p.ObjectType.torpedo, object=2))
+    events = tracker.drain_proximity_events()
+    eq_([(e.kind, e.source, e.target) for e in events], [('leave', 2, 1)])
+
+def test_mark_stale_until_updated():
+    tracker = Tracker()
+    tracker.update_object({'object': 1, 'type': p.ObjectType.mine})
+    tracker.update_object({'object': 2, 'type': p.ObjectType.mine})
+    tracker.mark_stale()
+    eq_(tracker.stale, {1, 2})
+    tracker.rx(mine_update(1, 0.0, 0.0, 0.0))
+    eq_(tracker.stale, {2})
+    eq_(set(tracker.objects), {1, 2})
+
+def test_change_tracking_stays_bounded():
+    now = [0.0]
+    tracker = Tracker(clock=lambda: now[0], ttl=1.0, max_objects=10)
+    for game in range(100):
+        tracker.rx(p.GameStartPacket())
+        for oid in range(50):
+            tracker.update_object({'object': game * 50 + oid, 'type': p.ObjectType.mine})
+        now[0] += 2.0
+        tracker.evict_stale()
+    eq_(tracker.objects, {})
+    eq_(tracker._dirty, set())
+    eq_(tracker._unsaved, set())
+
+def test_removal_after_snapshot_is_published():
+    tracker = Tracker()
+    tracker.update_object({'object': 1, 'type': p.ObjectType.mine})
+    snapshot = tracker.snapshot()
+    tracker.remove_object(1)
+    tracker.update_object({'object': 2, 'type': p.ObjectType.mine})
+    tracker.remove_object(2)
+    eq_(tracker._dirty, {1})
+    eq_(list(tracker.snapshot()), [])
+    eq_(list(snapshot), [1])